@@ -1,19 +1,29 @@
 import os
 import re
+import importlib.util
+import importlib.metadata
 import yaml
 import glob
 import random
 import csv
 import unicodedata
 import math
+import heapq
+import zlib
+import sys
+import multiprocessing
+import mmap
+import pickle
+import struct
+import hmac
 from datetime import datetime
+from functools import cached_property, lru_cache, wraps
+from contextlib import contextmanager
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 import pytz
 import json
-from google.cloud import texttospeech
-from google.cloud import speech
-from flask import Flask, render_template, request, jsonify
-import sendgrid
-from sendgrid.helpers.mail import Mail
+from flask import Flask, Response, g, render_template, request, jsonify
 import sqlite3
 import logging
 
@@ -45,17 +55,138 @@ def init_db():
     conn.commit()
     conn.close()
 
-init_db()
 import threading
 import time
 
+# ===== BOOT PROFILER =====
+# Wall time and memory growth of every start-up phase, in the main thread and
+# in the warm-up thread. The report is served on /boot_report and written to
+# BOOT_REPORT_PATH ({pid} is replaced, empty disables it) when the warm-up ends.
+BOOT_REPORT_PATH = os.environ.get("BOOT_REPORT_PATH", "boot_report.json")
+
+# Worker processes spawned by match_batch write no boot report, create no Google
+# clients and don't watch the corpus files. They import app before multiprocessing
+# sets parent_process() and sys.argv is the parent's, so the spawn flag tells them apart.
+BATCH_WORKER = "--multiprocessing-fork" in sys.orig_argv
+if BATCH_WORKER:
+    BOOT_REPORT_PATH = ""
+
+def current_rss():
+    """Resident set size of this process in bytes (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def process_age():
+    """Seconds since this process started (None where /proc is unavailable)"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return round(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 2)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def megabytes(size):
+    return None if size is None else round(size / 2 ** 20, 1)
+
+class BootProfiler:
+    """Timeline of the start-up: phases with their wall time and RSS growth (overlapping across threads), and milestones"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.age_at_start = process_age()
+        self.rss_start = current_rss()
+        self.phases = []
+        self.milestones = []
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def elapsed(self):
+        return round(time.perf_counter() - self.origin, 4)
+
+    @contextmanager
+    def phase(self, name):
+        """Record the wall time and RSS growth of the enclosed block (errors are recorded and re-raised)"""
+        rss = current_rss()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            after = current_rss()
+            with self.lock:
+                self.phases.append({
+                    "phase": name,
+                    "thread": threading.current_thread().name,
+                    "start_s": round(start - self.origin, 4),
+                    "wall_s": round(wall, 4),
+                    "rss_mb": megabytes(after),
+                    "rss_delta_mb": megabytes(after - rss) if rss is not None and after is not None else None,
+                    "error": error,
+                })
+
+    def mark(self, name):
+        """Record a readiness milestone"""
+        with self.lock:
+            self.milestones.append({"milestone": name, "at_s": self.elapsed()})
+
+    def report(self):
+        with self.lock:
+            phases = sorted(self.phases, key=lambda p: p["start_s"])
+            milestones = list(self.milestones)
+        return {
+            "pid": os.getpid(),
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "process_age_at_start_s": self.age_at_start,
+            "finished": self.finished is not None,
+            "total_s": self.finished if self.finished is not None else self.elapsed(),
+            "rss_start_mb": megabytes(self.rss_start),
+            "rss_mb": megabytes(current_rss()),
+            "phases": phases,
+            "milestones": milestones,
+        }
+
+    def finish(self, path=BOOT_REPORT_PATH):
+        """Close the boot timeline, log a summary and write the report to path"""
+        self.finished = self.elapsed()
+        self.mark("ready")
+        report = self.report()
+        logger.info(f"Boot finished in {self.finished:.2f}s: " + ", ".join(
+            f"{p['phase']} {p['wall_s']:.2f}s" for p in report["phases"]
+        ))
+        if not path:
+            return
+        path = path.format(pid=os.getpid())
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        except OSError as e:
+            logger.warning(f"Could not write boot report {path}: {e}")
+
+boot_profiler = BootProfiler()
+
+with boot_profiler.phase("init_db"):
+    init_db()
+
 # Google credentials file (kept as environment or default filename)
 GOOGLE_CREDENTIALS = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS") or "speakai-467308-fb5a36feacef.json"
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = GOOGLE_CREDENTIALS
 
-# Reuse Google clients to avoid per-request startup/auth overhead
+# Reuse Google clients to avoid per-request startup/auth overhead. The
+# client libraries take seconds to import, so clients are created on first
+# use or by the warm-up thread started at the end of this module.
 TTS_CLIENT = None
 SPEECH_CLIENT = None
+GOOGLE_CLIENTS_LOCK = threading.Lock()
 
 # Simple in-memory cache for TTS audio: key -> {audio: bytes, ts: timestamp}
 TTS_CACHE = {}
@@ -63,26 +194,28 @@ TTS_CACHE_LOCK = threading.Lock()
 TTS_CACHE_TTL = 60 * 60  # 1 hour default TTL for cached audio
 PENDING_TTS = set()
 
-try:
-    TTS_CLIENT = texttospeech.TextToSpeechClient()
-except Exception as e:
-    logger.warning(f"Could not initialize TextToSpeechClient at startup: {e}")
-
-try:
-    SPEECH_CLIENT = speech.SpeechClient()
-except Exception as e:
-    logger.warning(f"Could not initialize SpeechClient at startup: {e}")
+def get_tts_client():
+    """Pooled TextToSpeechClient, created on first use (raises if it cannot be created)"""
+    global TTS_CLIENT
+    with GOOGLE_CLIENTS_LOCK:
+        if TTS_CLIENT is None:
+            from google.cloud import texttospeech
+            TTS_CLIENT = texttospeech.TextToSpeechClient()
+        return TTS_CLIENT
+
+def get_speech_client():
+    """Pooled SpeechClient, created on first use (raises if it cannot be created)"""
+    global SPEECH_CLIENT
+    with GOOGLE_CLIENTS_LOCK:
+        if SPEECH_CLIENT is None:
+            from google.cloud import speech
+            SPEECH_CLIENT = speech.SpeechClient()
+        return SPEECH_CLIENT
 
 def synth_text_to_mp3(text, voice_name="it-IT-Chirp3-HD-Enceladus"):
     """Synthesize given text to MP3 bytes using the pooled TTS client."""
-    if not TTS_CLIENT:
-        # lazy create if previous init failed
-        try:
-            client = texttospeech.TextToSpeechClient()
-        except Exception:
-            raise
-    else:
-        client = TTS_CLIENT
+    from google.cloud import texttospeech
+    client = get_tts_client()
 
     formatted_text = format_numbers_for_speech(text)
     synthesis_input = texttospeech.SynthesisInput(text=formatted_text)
@@ -138,6 +271,9 @@ def find_appointment(name=None, phone=None):
 SENDGRID_API_KEY = os.environ.get("SENDGRID_API_KEY")  #
 
 def send_appointment_email(patient_name, patient_phone, patient_date):
+    import sendgrid
+    from sendgrid.helpers.mail import Mail
+
     subject = f"Nuova Prenotazione Visita - {patient_name}"
     body = (
         f"Gentile Team Otofarma,\n\n"
@@ -206,8 +342,19 @@ except ImportError:
     raise ImportError("Install flask-cors: pip install flask-cors")
 app = Flask(__name__)
 CORS(app)
-# Google Cloud Speech-to-Text import (if not already present)
-from google.cloud import speech
+
+# Diagnostic endpoints answer only requests with this token in X-Admin-Token (unset: they are disabled)
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def admin_only(view):
+    """Refuse the request with 403 unless it carries ADMIN_TOKEN"""
+    @wraps(view)
+    def guarded(*args, **kwargs):
+        token = request.headers.get("X-Admin-Token", "")
+        if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({"error": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return guarded
 
 # /transcribe endpoint for speech-to-text
 @app.route("/transcribe", methods=["POST"])
@@ -221,7 +368,8 @@ def transcribe():
 
     # Use pooled SPEECH_CLIENT if available
     try:
-        client = SPEECH_CLIENT if 'SPEECH_CLIENT' in globals() and SPEECH_CLIENT else speech.SpeechClient()
+        from google.cloud import speech
+        client = get_speech_client()
     except Exception as e:
         if 'logger' in globals():
             logger.error(f"Could not create SpeechClient: {e}")
@@ -250,44 +398,117 @@ def transcribe():
             logger.error(f"Speech recognition failed: {e}")
         return jsonify({"error": "Speech recognition failed"}), 500
     
-# Add these new imports for Gemini API
-import vertexai
-from vertexai.generative_models import GenerativeModel
+# The Italian dictionary takes a while to load and, with the spelling index
+# in the corpus snapshot, is only needed to rebuild that index: load it on first use
+spellchecker_available = importlib.util.find_spec("spellchecker") is not None
+SPELL = None
+SPELL_LOCK = threading.Lock()
 
-try:
-    import nltk
-    nltk.download('punkt', quiet=True)
-    nltk.download('averaged_perceptron_tagger', quiet=True)
-    nltk.download('stopwords', quiet=True)
-    from nltk.tokenize import word_tokenize
-    from nltk.corpus import stopwords
-    from nltk import pos_tag
-    nltk_it_stopwords = set(stopwords.words('italian'))
-    nltk_available = True
-except Exception:
-    nltk_available = False
+def spell_checker():
+    """pyspellchecker's Italian SpellChecker, created on first use"""
+    global SPELL
+    with SPELL_LOCK:
+        if SPELL is None:
+            from spellchecker import SpellChecker
+            SPELL = SpellChecker(language="it")
+        return SPELL
 
-try:
-    from spellchecker import SpellChecker
-    spell = SpellChecker(language="it")
-    spellchecker_available = True
-except Exception:
-    spellchecker_available = False
-    spell = None
 
+# numpy holds the spelling index, the rapidfuzz score matrices and the pharmacy
+# coordinates (nearest pharmacies are found by a loop without it)
+numpy_available = importlib.util.find_spec("numpy") is not None
+if numpy_available:
+    import numpy as np
 
 try:
     from rapidfuzz import process, fuzz, distance
-    rapidfuzz_available = True
+    rapidfuzz_available = numpy_available  # process.cdist returns numpy score matrices
 except ImportError:
     rapidfuzz_available = False
 
-try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
-    from sklearn.metrics.pairwise import cosine_similarity
-    nlp_available = True
-except ImportError:
-    nlp_available = False
+# scikit-learn takes over a second to import: it is imported where the
+# indexes are built or unpickled, which happens in the warm-up thread
+nlp_available = importlib.util.find_spec("sklearn") is not None
+if nlp_available:
+    sklearn_version = importlib.metadata.version("scikit-learn")
+
+# ===== PATTERN BANKS =====
+# Every family of detector regexes is compiled once into a single alternation
+# with one named group per rule, so a detector makes one pass over the text
+# and still knows which rule fired.
+# PATTERN_STATS=1 counts how often each rule fires, for /match_stats. The counts
+# are taken without a lock, so they may miss a few hits under concurrency.
+PATTERN_STATS = os.environ.get("PATTERN_STATS", "").lower() in ("1", "true", "yes")
+
+def top_level_alternation(pattern):
+    """True when pattern has a | outside any group or character class"""
+    depth = 0
+    in_class = escaped = False
+    for ch in pattern:
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif in_class:
+            in_class = ch != "]"
+        elif ch == "[":
+            in_class = True
+        elif ch in "()":
+            depth += 1 if ch == "(" else -1
+        elif ch == "|" and depth == 0:
+            return True
+    return False
+
+class PatternBank:
+    """Regex rules compiled into one matcher; search() returns the label of the leftmost rule, or of the first listed one"""
+    def __init__(self, name, rules, flags=0, first_listed=False, anchored=False):
+        # rules: patterns (their own label) or (pattern, label); first_listed: the first rule of
+        # the list that matches anywhere wins, as in a loop of re.search; anchored: re.match
+        self.name = name
+        self.rules = [(rule, rule) if isinstance(rule, str) else tuple(rule) for rule in rules]
+        patterns = [pattern for pattern, _ in self.rules]
+        # A \b shared by every rule is tested once per position instead of once per rule and position
+        prefix = ""
+        if all(p.startswith(r"\b") and not top_level_alternation(p) for p in patterns):
+            prefix, patterns = r"\b", [p[2:] for p in patterns]
+        regex = re.compile(prefix + "(?:" + "|".join(f"(?P<r{i}>{p})" for i, p in enumerate(patterns)) + ")", flags)
+        self.matcher = regex.match if anchored else regex.search
+        # Rules listed before the one that fired first are checked on their own
+        self.earlier = [re.compile(p, flags).search for p, _ in self.rules] if first_listed and not anchored else None
+        self.hits = [0] * len(self.rules)
+
+    def search(self, text):
+        """Label of the rule that fired on text, or None"""
+        m = self.matcher(text)
+        if m is None:
+            return None
+        index = int(m.lastgroup[1:])
+        if self.earlier:
+            index = next(i for i in range(index + 1) if i == index or self.earlier[i](text))
+        if PATTERN_STATS:
+            self.hits[index] += 1
+        return self.rules[index][1]
+
+    def stats(self):
+        hits = Counter()
+        for (_, label), count in zip(self.rules, self.hits):
+            if count:
+                hits[label] += count
+        return dict(hits.most_common())
+
+    def reset(self):
+        self.hits = [0] * len(self.rules)
+
+PATTERN_BANKS = {}
+
+def pattern_bank(name, rules, **options):
+    """Compile a family of rules into a PatternBank registered under name"""
+    bank = PATTERN_BANKS[name] = PatternBank(name, rules, **options)
+    return bank
+
+def pattern_bank_stats():
+    """How often each rule of each bank fired"""
+    return {name: bank.stats() for name, bank in PATTERN_BANKS.items()}
 
 ASSISTANT_NAME = "OtoBot"
 
@@ -308,6 +529,8 @@ EXTENDED_ASSISTANT_NAME_PATTERNS = [
     r"\b(assistente\s+otofarma)\b",
     r"\b(virtual\s+assistant)\b"
 ]
+PRECISE_ASSISTANT_NAME_BANK = pattern_bank("precise_assistant_name", PRECISE_ASSISTANT_NAME_PATTERNS)
+EXTENDED_ASSISTANT_NAME_BANK = pattern_bank("extended_assistant_name", EXTENDED_ASSISTANT_NAME_PATTERNS)
 
 VOICE_ACTIVATION_KEYWORDS = {
     "otobot", "oto bot", "assistente virtuale", "assistente otofarma", 
@@ -330,6 +553,7 @@ ENHANCED_ACTIVATION_PATTERNS = [
     r"\s+otobot\b",
     r"^otobot$"
 ]
+ENHANCED_ACTIVATION_BANK = pattern_bank("enhanced_activation", ENHANCED_ACTIVATION_PATTERNS, flags=re.IGNORECASE)
 
 def detect_enhanced_voice_activation(text):
     """Enhanced voice activation detection for Hey OtoBot"""
@@ -337,12 +561,11 @@ def detect_enhanced_voice_activation(text):
         return False
    
         
-    text_clean = normalize(text.strip())
+    text_clean = normalized_text(text, corrected=False)
     
-    # Check enhanced patterns0
-    for pattern in ENHANCED_ACTIVATION_PATTERNS:
-        if re.search(pattern, text_clean, re.IGNORECASE):
-            return True
+    # Check enhanced patterns
+    if ENHANCED_ACTIVATION_BANK.search(text_clean):
+        return True
     
     # Check if message starts or ends with activation words
     words = text_clean.split()
@@ -418,6 +641,17 @@ COMMON_MISSPELLINGS = {
     "perche": "perché", "servizio": "servizio", "servizi": "servizi"
 }
 
+# Question words that are never spell-checked
+QUESTION_WORDS = {"chi", "cosa", "dove", "quando", "quanto", "quale", "come", "perché", "perche"}
+
+def compile_misspellings(misspellings):
+    """One case-insensitive alternation of the misspellings, longest first: (pattern, lowercase table, correct forms)"""
+    lookup = {wrong.lower(): right for wrong, right in misspellings.items()}
+    alternation = "|".join(re.escape(wrong) for wrong in sorted(lookup, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternation})\b", re.IGNORECASE), lookup, set(lookup.values())
+
+MISSPELLINGS_RE, MISSPELLINGS_LOOKUP, MISSPELLINGS_TARGETS = compile_misspellings(COMMON_MISSPELLINGS)
+
 def glue_split(text):
     """Fix common word concatenation issues"""
     for k in ["ciao", "salve", "buongiorno", "buonasera", "comeva", "comeva?", "come ba", "otobot"]:
@@ -425,55 +659,263 @@ def glue_split(text):
             text = text.replace(k, f"{k} ")
     return text
 
+class LRUCache:
+    """Bounded, thread-safe least-recently-used cache with hit/miss counters"""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return (found, value)"""
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return True, self.data[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
+
+# Voice users repeat the same short utterances, so whole messages and single words are memoized
+MESSAGE_CORRECTION_CACHE = LRUCache(int(os.environ.get("MESSAGE_CORRECTION_CACHE_SIZE", 4096)))
+WORD_CORRECTION_CACHE = LRUCache(int(os.environ.get("WORD_CORRECTION_CACHE_SIZE", 20000)))
+
+def invalidate_spelling_caches():
+    """Drop memoized corrections (call after changing the dictionary or COMMON_MISSPELLINGS)"""
+    MESSAGE_CORRECTION_CACHE.clear()
+    WORD_CORRECTION_CACHE.clear()
+
+def reload_common_misspellings():
+    """Recompile the COMMON_MISSPELLINGS replacer after editing the table"""
+    global MISSPELLINGS_RE, MISSPELLINGS_LOOKUP, MISSPELLINGS_TARGETS
+    MISSPELLINGS_RE, MISSPELLINGS_LOOKUP, MISSPELLINGS_TARGETS = compile_misspellings(COMMON_MISSPELLINGS)
+    invalidate_spelling_caches()
+
+def spelling_cache_stats():
+    """Hit/miss counters of the spelling correction caches"""
+    return {
+        "messages": MESSAGE_CORRECTION_CACHE.stats(),
+        "words": WORD_CORRECTION_CACHE.stats()
+    }
+
+class IndexState:
+    """Plain-data (de)serialization of a search structure for the corpus snapshot (builtins, arrays and sklearn models only)"""
+    nested = {}      # attribute -> IndexState class of a nested structure
+    transient = ()   # attributes rebuilt by restore() instead of stored
+
+    def to_state(self):
+        state = {k: v for k, v in self.__dict__.items() if k not in self.transient}
+        for name in self.nested:
+            if state[name] is not None:
+                state[name] = state[name].to_state()
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        obj = cls.__new__(cls)
+        obj.__dict__.update(state)
+        for name, nested_cls in cls.nested.items():
+            if state[name] is not None:
+                setattr(obj, name, nested_cls.from_state(state[name]))
+        obj.restore()
+        return obj
+
+    def restore(self):
+        """Rebuild the transient attributes after from_state"""
+
+def spelling_deletes(word, max_distance):
+    """All strings obtained by deleting up to max_distance characters from word"""
+    deletes = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+        deletes |= frontier
+    return deletes
+
+class SymSpellIndex(IndexState):
+    """Symmetric-delete spelling index (SymSpell): candidates come from binary searches over the hashes of prefix deletes"""
+    transient = ("word_ids",)
+
+    def __init__(self, words, freqs, hashes, ids, max_distance=2, prefix_length=7):
+        self.words = words
+        self.freqs = freqs
+        self.hashes = hashes
+        self.ids = ids
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.restore()
+
+    def restore(self):
+        self.word_ids = {w: i for i, w in enumerate(self.words)}
+
+    @classmethod
+    def build(cls, vocabulary, max_distance=2, prefix_length=7):
+        empty = cls([], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32),
+                    np.zeros(0, dtype=np.int32), max_distance, prefix_length)
+        return empty.updated(vocabulary)
+
+    def updated(self, vocabulary):
+        """Index over a new vocabulary, reusing the delete hashes of the words already indexed"""
+        words = sorted(vocabulary)
+        freqs = np.array([vocabulary[w] for w in words], dtype=np.int64)
+        new_ids = {w: i for i, w in enumerate(words)}
+
+        # Renumber the kept entries; words dropped from the vocabulary map to -1.
+        # Both vocabularies are sorted, so the kept entries stay in (hash, id) order.
+        remap = np.array([new_ids.get(w, -1) for w in self.words], dtype=np.int64)
+        kept_ids = remap[self.ids] if len(self.ids) else np.zeros(0, dtype=np.int64)
+        kept = kept_ids >= 0
+        kept_keys = (self.hashes[kept].astype(np.uint64) << np.uint64(32)) | kept_ids[kept].astype(np.uint64)
+
+        added_keys = []
+        for word in words:
+            if word not in self.word_ids:
+                for delete in spelling_deletes(word[:self.prefix_length], self.max_distance):
+                    added_keys.append((zlib.crc32(delete.encode("utf-8")) << 32) | new_ids[word])
+        added_keys = np.sort(np.array(added_keys, dtype=np.uint64))
+
+        # Merge the new entries into the sorted ones instead of sorting everything again
+        keys = np.insert(kept_keys, np.searchsorted(kept_keys, added_keys), added_keys)
+        hashes = (keys >> np.uint64(32)).astype(np.uint32)
+        ids = (keys & np.uint64(0xFFFFFFFF)).astype(np.int32)
+        return type(self)(words, freqs, hashes, ids, self.max_distance, self.prefix_length)
+
+    def known(self, word):
+        return word.lower() in self.word_ids
+
+    def correction(self, word):
+        """Most frequent dictionary word at the smallest edit distance (<= max_distance), or None"""
+        if word.lower() in self.word_ids:
+            return word
+
+        word = word.lower()
+        deletes = spelling_deletes(word[:self.prefix_length], self.max_distance)
+        keys = np.array([zlib.crc32(d.encode("utf-8")) for d in deletes], dtype=np.uint32)
+        lo = np.searchsorted(self.hashes, keys, side="left")
+        hi = np.searchsorted(self.hashes, keys, side="right")
+
+        best = None
+        best_key = None
+        for start, end in zip(lo, hi):
+            for idx in self.ids[start:end].tolist():
+                candidate = self.words[idx]
+                dist = distance.DamerauLevenshtein.distance(word, candidate, score_cutoff=self.max_distance)
+                if dist > self.max_distance:
+                    continue
+                key = (dist, -self.freqs[idx])
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+        return best
+
+spelling_index = None
+
+def spelling_vocabulary(corpus):
+    """Italian dictionary words plus corpus, city and pharmacy vocabulary"""
+    vocabulary = dict(spell_checker().word_frequency.dictionary)
+    domain_texts = list(corpus.questions) + list(corpus.answers)
+    for ph in pharmacies:
+        for key in ("Nome", "Farmacia", "città", "Città", "provincia", "Provincia", "indirizzo", "Indirizzo"):
+            if ph.get(key):
+                domain_texts.append(ph[key])
+    for text in domain_texts:
+        for word in re.findall(r"[^\W\d_]+", str(text).lower()):
+            if len(word) > 1:
+                vocabulary[word] = vocabulary.get(word, 0) + 1
+    return vocabulary
+
+def build_spelling_index(corpus):
+    """Build the spelling index over the corpus and pharmacy vocabulary"""
+    if not (spellchecker_available and rapidfuzz_available):
+        return None
+
+    start = time.time()
+    index = SymSpellIndex.build(spelling_vocabulary(corpus))
+    print(f"Built spelling index with {len(index.words)} words in {time.time() - start:.1f}s")
+    return index
+
+def spelling_correction(word):
+    """Dictionary correction of a single word (SymSpell index, pyspellchecker as fallback)"""
+    found, correction = WORD_CORRECTION_CACHE.get(word)
+    if found:
+        return correction
+
+    if spelling_index is not None:
+        correction = spelling_index.correction(word)
+    else:
+        correction = spell_checker().correction(word)
+    WORD_CORRECTION_CACHE.put(word, correction)
+    return correction
+
 def advanced_spelling_correction(text):
     """Enhanced spell correction with context awareness"""
     text = glue_split(text)
     
-    # First pass - common misspellings
-    for wrong, right in COMMON_MISSPELLINGS.items():
-        text = re.sub(rf'\b{wrong}\b', right, text, flags=re.IGNORECASE)
+    # First pass - common misspellings, all fixed in a single scan
+    text = MISSPELLINGS_RE.sub(lambda m: MISSPELLINGS_LOOKUP[m.group(0).lower()], text)
     
     # Second pass - intelligent spell checking
     if spellchecker_available and text:
-        words = re.findall(r'\w+', text)
-        corrections = []
+        parts = []
+        last_end = 0
         
-        for word in words:
+        for match in re.finditer(r'\w+', text):
+            word = match.group(0)
             word_lower = word.lower()
+            corrected = word
             
-            # Skip if already a common Italian word
-            if word_lower in COMMON_MISSPELLINGS.values():
-                corrections.append(word)
-                continue
-                
-            # Skip question words that are often correct
-            if word_lower in ["chi", "cosa", "dove", "quando", "quanto", "quale", "come", "perché", "perche"]:
-                corrections.append(word)
-                continue
-                
-            correction = spell.correction(word)
-            if correction and rapidfuzz_available:
-                similarity = fuzz.ratio(word.lower(), correction.lower())
-                if similarity >= 70:  # More lenient threshold
-                    corrections.append(correction)
-                else:
-                    corrections.append(word)
-            else:
-                corrections.append(word)
-        
-        # Reconstruct text with corrections
-        fixed = text
-        for original, corrected in zip(words, corrections):
-            if original != corrected:
-                fixed = re.sub(r'\b{}\b'.format(re.escape(original)), corrected, fixed, count=1)
+            # Skip common Italian words and question words that are often correct
+            if word_lower not in MISSPELLINGS_TARGETS and word_lower not in QUESTION_WORDS:
+                correction = spelling_correction(word)
+                if correction and rapidfuzz_available:
+                    similarity = fuzz.ratio(word_lower, correction.lower())
+                    if similarity >= 70:  # More lenient threshold
+                        corrected = correction
+            
+            # Reconstruct text with corrections from the token spans
+            parts.append(text[last_end:match.start()])
+            parts.append(corrected)
+            last_end = match.end()
         
-        return fixed
+        parts.append(text[last_end:])
+        return "".join(parts)
     
     return text
 
 def correct_spelling(text):
-    """Wrapper for backward compatibility"""
-    return advanced_spelling_correction(text)
+    """Wrapper for backward compatibility, memoized per message"""
+    found, corrected = MESSAGE_CORRECTION_CACHE.get(text)
+    if found:
+        return corrected
+
+    corrected = advanced_spelling_correction(text)
+    MESSAGE_CORRECTION_CACHE.put(text, corrected)
+    return corrected
 
 # More specific patterns for office hours detection
 OFFICE_PATTERNS = [
@@ -484,6 +926,7 @@ OFFICE_PATTERNS = [
     r"\b(orari\s*assistenz)\b", r"\b(office\s*hours)\b", r"\b(business\s*hours)\b",
     r"\b(aperti)\b", r"\b(chiusi)\b"
 ]
+OFFICE_BANK = pattern_bank("office_hours", OFFICE_PATTERNS)
 
 OFFICE_TIMES = [
     "Gli uffici Otofarma sono aperti dal lunedì al venerdì dalle 9:00 alle 18:30 (ora italiana).",
@@ -527,6 +970,12 @@ FUZZY_DATE_PATTERNS = [
     r"^giorno\s*della\s*settimana$", 
     r"^quale\s*giorno\s*(è)?$"
 ]
+# Time patterns are tried before date patterns
+TIME_DATE_BANK = pattern_bank(
+    "time_date",
+    [(p, "time") for p in FUZZY_TIME_PATTERNS] + [(p, "date") for p in FUZZY_DATE_PATTERNS],
+    anchored=True
+)
 
 # Use environment variable if available, else fallback to 'corpus' directory in current folder
 CORPUS_PATH = os.environ.get("CORPUS_PATH", os.path.join(os.path.dirname(__file__), "corpus"))
@@ -636,41 +1085,64 @@ CORPORATE_PATTERNS = [
     (r"\b(come.*funzioni|architettura|come.*lavori|tecnologia|algoritmi|neural)\b", "architecture"),
     (r"\b(how.*were.*you.*created|how.*were.*you.*made|how.*do.*you.*work)\b", "creator")
 ]
+# Topics overlap (a CEO question can also mention the headquarters): the first listed rule wins
+CORPORATE_BANK = pattern_bank("corporate", CORPORATE_PATTERNS, flags=re.IGNORECASE, first_listed=True)
 
-# Load YAML Q&A pairs with better error handling
-all_qa_pairs = []
-yaml_files_loaded = 0
+def corpus_yaml_files(corpus_path=CORPUS_PATH):
+    """Modification time of every YAML file of the corpus, in load order"""
+    return {
+        os.path.abspath(p): os.path.getmtime(p)
+        for p in glob.glob(os.path.join(corpus_path, "**", "*.yml"), recursive=True)
+    }
 
-for yml_file in glob.glob(os.path.join(CORPUS_PATH, "**", "*.yml"), recursive=True):
+def parse_yaml_corpus_file(yml_file):
+    """Q&A pairs of one YAML corpus file (raises on invalid YAML)"""
+    qa_pairs = []
     with open(yml_file, encoding='utf-8') as f:
-        try:
-            data = yaml.safe_load(f)
-            if not data:
-                continue
-                
-            conversations = data.get('conversations', [])
-            for conv in conversations:
-                if isinstance(conv, list) and len(conv) >= 2:
-                    question = conv[0]
-                    answers = conv[1:]
-                    
-                    if question and question.strip():
-                        # Join all answer parts
-                        full_answer = " ".join([str(x) for x in answers if x is not None and str(x).strip()])
-                        if full_answer:
-                            all_qa_pairs.append((question.strip(), full_answer))
-                            
-            yaml_files_loaded += 1
-            print(f"Loaded {len(conversations)} conversations from {os.path.basename(yml_file)}")
+        data = yaml.safe_load(f)
+    if not data:
+        return qa_pairs
+        
+    conversations = data.get('conversations', [])
+    for conv in conversations:
+        if isinstance(conv, list) and len(conv) >= 2:
+            question = conv[0]
+            answers = conv[1:]
             
+            if question and question.strip():
+                # Join all answer parts
+                full_answer = " ".join([str(x) for x in answers if x is not None and str(x).strip()])
+                if full_answer:
+                    qa_pairs.append((question.strip(), full_answer))
+                    
+    print(f"Loaded {len(conversations)} conversations from {os.path.basename(yml_file)}")
+    return qa_pairs
+
+def load_yaml_corpus(corpus_path=CORPUS_PATH):
+    """Load YAML Q&A pairs with better error handling: {path: (mtime, pairs)}"""
+    files = {}
+    for yml_file, mtime in corpus_yaml_files(corpus_path).items():
+        try:
+            files[yml_file] = (mtime, parse_yaml_corpus_file(yml_file))
         except Exception as e:
             print(f"Failed to parse {yml_file}: {e}")
+            files[yml_file] = (mtime, [])
 
-print(f"Total YAML files loaded: {yaml_files_loaded}")
-print(f"Total Q&A pairs loaded: {len(all_qa_pairs)}")
+    print(f"Total YAML files loaded: {len(files)}")
+    print(f"Total Q&A pairs loaded: {sum(len(pairs) for _, pairs in files.values())}")
+    return files
 
-qa_questions = [q for q, _ in all_qa_pairs]
-qa_answers = [a for _, a in all_qa_pairs]
+# Q&A corpus, installed by install_corpus() from the snapshot or the YAML files.
+# Requests read corpus_index once: a reload swaps it whole.
+corpus_index = None
+all_qa_pairs = []
+qa_questions = []
+qa_answers = []
+
+def corpus_for(questions):
+    """The installed CorpusIndex when questions is its question list, else None"""
+    corpus = corpus_index
+    return corpus if corpus is not None and questions is corpus.questions else None
 
 def normalize(text):
     """Enhanced text normalization"""
@@ -690,151 +1162,365 @@ def normalize(text):
     
     return text
 
+# Italian function words never used as keywords (accents stripped, as normalize() does)
+ITALIAN_STOPWORDS = frozenset("""
+    il lo la i gli le un una uno l dei delle del della dello degli di a da in con su per tra fra
+    al allo alla ai agli alle all dal dallo dalla dai dagli dalle dall nel nello nella nei negli nelle nell
+    sul sullo sulla sui sugli sulle sull col coi dell
+    che e o ed ma anche come quando dove chi cosa perche quali qual quale quanto quanta quanti quante
+    questo questa questi queste quello quella quelli quelle
+    io tu lui lei noi voi loro mi ti si ci vi me te se ne
+    mio mia miei mie tuo tua tuoi tue suo sua suoi sue nostro nostra nostri nostre vostro vostra vostri vostre
+    sono sei siamo siete era eri fu fui eravamo eravate erano sia siano fosse fossero sara sarebbe stato stata
+    ho hai ha abbiamo avete hanno avevo aveva avevano abbia
+    posso puoi puo possiamo potete possono potrei potrebbe devo devi deve dobbiamo dovete devono
+    vorrei vuoi vuole vogliamo volete vogliono fare faccio fai fa facciamo fanno
+    non piu meno molto tanto tutta tutto tutti tutte ogni alcuni alcune gia ancora sempre mai
+    qui qua li sopra sotto dentro fuori prima dopo durante mentre poi quindi pero invece infatti inoltre
+    comunque tuttavia pure solo soltanto appena subito presto tardi oggi ieri domani ora adesso
+    bene male meglio peggio cosi
+""".split())
+KEYWORD_TOKEN_RE = re.compile(r"[^\W_]+")
+# Keywords kept per text: the first distinct ones
+MAX_KEYWORDS = 8
+
+@lru_cache(maxsize=int(os.environ.get("STEM_CACHE_SIZE", 50000)))
+def italian_stem(word):
+    """Light Italian stemmer: drops gender and number endings so that singular and plural forms match"""
+    if not word.isalpha():
+        return word
+    # acustiche -> acustic, farmacia/farmacie -> farmac, apparecchio/apparecchi -> apparecch,
+    # segnalare/segnalo -> segnal
+    for suffixes, cut in (
+        (("are", "ere", "ire"), 3), (("che", "ghe"), 2), (("ia", "ie", "ii", "io"), 2), (("a", "e", "i", "o"), 1)
+    ):
+        if word.endswith(suffixes) and len(word) - cut >= 3:
+            return word[:-cut]
+    return word
+
+def normalized_keywords(text_norm):
+    """Keywords of an already normalized text"""
+    keywords = set()
+    for word in KEYWORD_TOKEN_RE.findall(text_norm):
+        if len(word) > 2 and word not in ITALIAN_STOPWORDS:
+            keywords.add(italian_stem(word))
+            if len(keywords) == MAX_KEYWORDS:
+                break
+    return keywords
+
 def extract_keywords(text):
-    """Enhanced keyword extraction with better Italian support"""
+    """Stemmed content words of a text, without stop words and words of one or two letters"""
     if not text:
         return set()
-        
-    if nltk_available:
-        try:
-            words = word_tokenize(normalize(text))
-            # Filter stopwords and short words
-            filtered = [w for w in words if w not in nltk_it_stopwords and len(w) > 2]
-            
-            # Get POS tags
-            tagged = pos_tag(filtered)
-            
-            # Extract important words (nouns, adjectives, foreign words)
-            keywords = [w for w, t in tagged if t.startswith('NN') or t.startswith('JJ') or t == 'FW']
-            
-            # If no keywords found, use filtered words
-            main_words = keywords if keywords else filtered[:8]
-            
-            return set(main_words)
-            
-        except Exception:
-            pass
-    
-    # Fallback method with enhanced Italian stopwords
-    italian_stopwords = {
-        "il", "lo", "la", "i", "gli", "le", "un", "una", "uno", "dei", "delle", "del", "della", "dello",
-        "che", "di", "a", "da", "in", "con", "su", "per", "tra", "fra", "sono", "sei", "è", "siamo", 
-        "siete", "ho", "hai", "ha", "abbiamo", "avete", "hanno", "era", "eri", "fu", "fui", "eravamo", 
-        "eravate", "erano", "ma", "e", "o", "ed", "anche", "come", "quando", "dove", "chi", "cosa", 
-        "perche", "perché", "quali", "qual", "quale", "questo", "questa", "quello", "quella", "questi", 
-        "quelle", "quelli", "al", "agli", "alle", "del", "della", "dello", "degli", "delle", "dei",
-        "sul", "sullo", "sulla", "sulle", "sui", "all", "alla", "allo", "alle", "queste", "questo", 
-        "questi", "quella", "quello", "quelle", "quelli", "tu", "te", "io", "noi", "voi", "loro", 
-        "più", "piu", "meno", "molto", "tanto", "tutta", "tutto", "tutti", "tutte", "ogni", "alcuni", 
-        "alcune", "mi", "ti", "si", "ci", "vi", "lui", "lei", "se", "già", "gia", "ancora", "sempre", 
-        "mai", "qui", "qua", "lì", "li", "là", "la", "sopra", "sotto", "dentro", "fuori", "prima", 
-        "dopo", "durante", "mentre", "poi", "quindi", "però", "pero", "invece", "infatti", "inoltre", 
-        "comunque", "tuttavia", "pure", "solo", "soltanto", "appena", "subito", "presto", "tardi", 
-        "oggi", "ieri", "domani", "ora", "adesso", "bene", "male", "meglio", "peggio", "così", "cosi"
-    }
-    
-    words = normalize(text).split()
-    filtered = [w for w in words if w not in italian_stopwords and len(w) > 2]
-    
-    return set(filtered[:8])
+    return normalized_keywords(normalize(text))
+
+class MessageAnalysis:
+    """Per-request preprocessing of a user message, computed once and shared by every detector"""
+    def __init__(self, text):
+        self.text = text or ""
+
+    def __bool__(self):
+        return bool(self.text)
+
+    @cached_property
+    def corrected(self):
+        return correct_spelling(self.text)
+
+    @cached_property
+    def normalized(self):
+        return normalize(self.corrected)
+
+    @cached_property
+    def raw_normalized(self):
+        return normalize(self.text)
+
+    @cached_property
+    def tokens(self):
+        return self.normalized.split()
+
+    @cached_property
+    def keywords(self):
+        return normalized_keywords(self.normalized)
+
+def analyze_message(msg):
+    """Wrap a plain string in a MessageAnalysis (analyses are returned as is)"""
+    return msg if isinstance(msg, MessageAnalysis) else MessageAnalysis(msg)
+
+def normalized_text(msg, corrected=True):
+    """Normalized form of a message: cached on an analysis, computed for plain strings"""
+    if isinstance(msg, MessageAnalysis):
+        return msg.normalized if corrected else msg.raw_normalized
+    return normalize(msg)
+
+# Common question words ignored by the "cleaned" exact-match rule
+QUESTION_WORDS_RE = re.compile(r'\b(che|tipo|di|è|sono|cosa|come|quando|dove|quale|quanto)\b')
+
+def strip_question_words(text):
+    """Remove common question words from normalized text"""
+    return QUESTION_WORDS_RE.sub('', text).strip()
+
+class SubstringIndex(IndexState):
+    """Character n-gram index answering substring queries over a list of strings"""
+    def __init__(self, texts, min_len, n=3):
+        self.texts = texts
+        self.n = n
+        self.min_len = min_len
+        self.grams = {}
+        self.prefixes = {}
+        self.add(range(len(texts)))
+
+    def add(self, ids):
+        """Post the texts with these ids"""
+        n, min_len = self.n, self.min_len
+        for idx in ids:
+            text = self.texts[idx]
+            for size in range(1, n + 1):
+                for gram in {text[i:i + size] for i in range(len(text) - size + 1)}:
+                    self.grams.setdefault(gram, []).append(idx)
+            # Texts longer than min_len are keyed by their prefix so that
+            # texts contained in a query can be found with a sliding window
+            if len(text) > min_len:
+                self.prefixes.setdefault(text[:min_len + 1], []).append(idx)
+
+    def updated(self, texts):
+        """Index over new texts, renumbering the postings of the texts already indexed"""
+        new_ids = {}
+        for idx, text in enumerate(texts):
+            new_ids.setdefault(text, []).append(idx)
+        # Old id -> new id (-1 for a dropped text); repeated texts are paired in order
+        remap = [new_ids[text].pop(0) if new_ids.get(text) else -1 for text in self.texts]
+
+        index = type(self)([], self.min_len, self.n)
+        index.texts = texts
+        for source, target in ((self.grams, index.grams), (self.prefixes, index.prefixes)):
+            for key, posting in source.items():
+                kept = [remap[idx] for idx in posting if remap[idx] >= 0]
+                if kept:
+                    target[key] = kept
+        index.add(idx for ids in new_ids.values() for idx in ids)
+        return index
+
+    def containing(self, query):
+        """Ids of the texts that contain the (non-empty) query"""
+        size = min(self.n, len(query))
+        postings = [self.grams.get(query[i:i + size], ()) for i in range(len(query) - size + 1)]
+        if not postings:
+            return []
+        postings.sort(key=len)
+        ids = set(postings[0])
+        for posting in postings[1:]:
+            ids.intersection_update(posting)
+            if not ids:
+                return []
+        return [idx for idx in ids if query in self.texts[idx]]
+
+    def contained_in(self, query):
+        """Ids of the texts longer than min_len that are contained in the query"""
+        width = self.min_len + 1
+        ids = set()
+        for i in range(len(query) - width + 1):
+            for idx in self.prefixes.get(query[i:i + width], ()):
+                if self.texts[idx] in query:
+                    ids.add(idx)
+        return list(ids)
+
+class ExactMatchIndex(IndexState):
+    """Normalized and question-word-stripped forms of the corpus questions"""
+    nested = {"normalized_substrings": SubstringIndex, "cleaned_substrings": SubstringIndex}
+
+    def __init__(self, questions, normalized=None, previous=None):
+        self.normalized = normalized or [normalize(q) for q in questions]
+        # The cleaned forms and substring postings of the questions previous indexed are reused
+        old_cleaned = dict(zip(previous.normalized, previous.cleaned)) if previous else {}
+        self.cleaned = [old_cleaned[q] if q in old_cleaned else strip_question_words(q) for q in self.normalized]
+
+        # First question id for each normalized / cleaned form
+        self.by_normalized = {}
+        self.by_cleaned = {}
+        for idx, (q_norm, q_clean) in enumerate(zip(self.normalized, self.cleaned)):
+            self.by_normalized.setdefault(q_norm, idx)
+            if len(q_clean) > 5:
+                self.by_cleaned.setdefault(q_clean, idx)
+
+        # Substring rules only apply above these lengths
+        if previous:
+            self.normalized_substrings = previous.normalized_substrings.updated(self.normalized)
+            self.cleaned_substrings = previous.cleaned_substrings.updated(self.cleaned)
+        else:
+            self.normalized_substrings = SubstringIndex(self.normalized, min_len=15)
+            self.cleaned_substrings = SubstringIndex(self.cleaned, min_len=5)
 
-def intelligent_exact_match(user_msg, questions, answers):
+def intelligent_exact_match(user_msg, questions, answers, index=None):
     """Exact matching with intelligent preprocessing"""
-    user_norm = normalize(user_msg)
-    user_corr = normalize(correct_spelling(user_msg))
-    
-    for idx, question in enumerate(questions):
-        question_norm = normalize(question)
-        
-        # Exact match
-        if user_norm == question_norm or user_corr == question_norm:
-            return answers[idx], 1.0
-            
-        # Substring match for longer texts
-        if len(user_norm) > 15 and user_norm in question_norm:
-            return answers[idx], 0.95
-        if len(question_norm) > 15 and question_norm in user_norm:
-            return answers[idx], 0.95
-            
-        # Check without common question words
-        question_clean = re.sub(r'\b(che|tipo|di|è|sono|cosa|come|quando|dove|quale|quanto)\b', '', question_norm).strip()
-        user_clean = re.sub(r'\b(che|tipo|di|è|sono|cosa|come|quando|dove|quale|quanto)\b', '', user_norm).strip()
-        
-        if question_clean and user_clean and len(question_clean) > 5:
-            if user_clean in question_clean or question_clean in user_clean:
-                return answers[idx], 0.9
-    
-    return None, 0
-
-def enhanced_keyword_match(user_msg, questions, answers):
+    if index is None:
+        corpus = corpus_for(questions)
+        index = corpus.exact if corpus else ExactMatchIndex(questions)
+
+    analysis = analyze_message(user_msg)
+    user_norm = analysis.normalized
+    
+    # Exact match
+    exact_hits = [index.by_normalized[t] for t in (analysis.raw_normalized, user_norm) if t in index.by_normalized]
+        
+    # Substring match for longer texts
+    substring_hits = index.normalized_substrings.contained_in(user_norm)
+    if len(user_norm) > 15:
+        substring_hits += index.normalized_substrings.containing(user_norm)
+        
+    # Check without common question words
+    user_clean = strip_question_words(user_norm)
+    cleaned_hits = []
+    if user_clean:
+        if user_clean in index.by_cleaned:
+            cleaned_hits.append(index.by_cleaned[user_clean])
+        cleaned_hits += index.cleaned_substrings.contained_in(user_clean)
+        cleaned_hits += [idx for idx in index.cleaned_substrings.containing(user_clean) if len(index.cleaned[idx]) > 5]
+
+    # The first question in corpus order matching any rule wins, scored by the best rule it matches
+    best_idx, best_score = None, 0
+    for score, hits in ((1.0, exact_hits), (0.95, substring_hits), (0.9, cleaned_hits)):
+        if hits and (best_idx is None or min(hits) < best_idx):
+            best_idx, best_score = min(hits), score
+    if best_idx is None:
+        return None, 0
+    return answers[best_idx], best_score
+
+# Boost score for important domain keywords
+# Stemmed like the keywords they are compared with
+IMPORTANT_KEYWORDS = frozenset(italian_stem(w) for w in (
+    "assistenza", "inclusa", "tipo", "prova", "gratis", "mese", "prezzo", "ricaricabili", 
+    "fastidio", "orecchio", "caccia", "collegano", "pagare", "perdere", "garanzia", 
+    "acqua", "teleaudiologia", "apparecchi", "acustici", "costo", "costano", "online",
+    "resistenti", "vedere", "danno", "voglio", "parlarne", "familiare", "succede", 
+    "metto", "servizio", "servizi", "consulenza", "supporto", "aiuto"
+))
+
+class KeywordIndex(IndexState):
+    """Keyword sets of the corpus questions with a keyword -> question ids inverted index"""
+    def __init__(self, questions, keywords=None):
+        self.keywords = keywords or [extract_keywords(q) for q in questions]
+        self.postings = {}
+        for idx, q_keywords in enumerate(self.keywords):
+            for kw in q_keywords:
+                self.postings.setdefault(kw, []).append(idx)
+
+    def candidates(self, msg_keywords):
+        """Ids of the questions sharing at least one keyword, in corpus order"""
+        ids = set()
+        for kw in msg_keywords:
+            ids.update(self.postings.get(kw, ()))
+        return sorted(ids)
+
+def enhanced_keyword_match(user_msg, questions, answers, index=None):
     """Enhanced keyword matching with better scoring"""
-    msg_keywords = extract_keywords(user_msg)
+    msg_keywords = analyze_message(user_msg).keywords
     if not msg_keywords:
         return None, 0
+
+    if index is None:
+        corpus = corpus_for(questions)
+        index = corpus.keywords if corpus else KeywordIndex(questions)
     
     best_match = None
     best_score = 0
     
-    for idx, question in enumerate(questions):
-        q_keywords = extract_keywords(question)
-        if not q_keywords:
-            continue
+    # Only questions sharing a keyword can score above zero
+    for idx in index.candidates(msg_keywords):
+        q_keywords = index.keywords[idx]
             
         common_keywords = msg_keywords & q_keywords
-        if common_keywords:
-            # Calculate Jaccard similarity
-            jaccard_score = len(common_keywords) / len(msg_keywords | q_keywords)
-            
-            # Boost score for important domain keywords
-            important_keywords = {
-                "assistenza", "inclusa", "tipo", "prova", "gratis", "mese", "prezzo", "ricaricabili", 
-                "fastidio", "orecchio", "caccia", "collegano", "pagare", "perdere", "garanzia", 
-                "acqua", "teleaudiologia", "apparecchi", "acustici", "costo", "costano", "online",
-                "resistenti", "vedere", "danno", "voglio", "parlarne", "familiare", "succede", 
-                "metto", "servizio", "servizi", "consulenza", "supporto", "aiuto"
-            }
-            
-            important_matches = common_keywords & important_keywords
-            if important_matches:
-                jaccard_score += len(important_matches) * 0.2
+
+        # Calculate Jaccard similarity
+        jaccard_score = len(common_keywords) / len(msg_keywords | q_keywords)
+        
+        important_matches = common_keywords & IMPORTANT_KEYWORDS
+        if important_matches:
+            jaccard_score += len(important_matches) * 0.2
+        
+        # Extra boost for exact keyword matches
+        if len(common_keywords) >= 2:
+            jaccard_score += 0.1
             
-            # Extra boost for exact keyword matches
-            if len(common_keywords) >= 2:
-                jaccard_score += 0.1
-                
-            if jaccard_score > best_score and jaccard_score > 0.3:
-                best_score = jaccard_score
-                best_match = answers[idx]
+        if jaccard_score > best_score and jaccard_score > 0.3:
+            best_score = jaccard_score
+            best_match = answers[idx]
     
     return best_match, best_score
 
-def semantic_match(user_msg, questions, answers):
-    """Enhanced semantic matching"""
-    if not nlp_available or not questions:
-        return None, 0
-        
-    try:
-        # Preprocess texts
-        user_processed = normalize(correct_spelling(user_msg))
-        questions_processed = [normalize(q) for q in questions]
-        
-        corpus = questions_processed + [user_processed]
-        
+class SemanticIndex(IndexState):
+    """TF-IDF model fitted once over the corpus questions"""
+    transient = ("analyzer",)
+
+    def __init__(self, questions, normalized=None):
+        self.size = len(questions)
+        self.vectorizer = None
+        self.matrix = None
+        if not nlp_available or not questions:
+            return
+
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
         # Use TF-IDF with Italian-specific preprocessing
-        vectorizer = TfidfVectorizer(
+        self.vectorizer = TfidfVectorizer(
             min_df=1,
             max_df=0.9,
             ngram_range=(1, 2),
             stop_words=None  # We handle stopwords in preprocessing
         )
+        self.matrix = self.vectorizer.fit_transform(normalized or [normalize(q) for q in questions])
+        # IDF an unseen n-gram would get if the query were part of the fit
+        self.unknown_idf = math.log((len(questions) + 2) / 2) + 1
+        self.restore()
+
+    def restore(self):
+        if self.vectorizer is not None:
+            self.analyzer = self.vectorizer.build_analyzer()
+
+    def known_weight(self, text_norm):
+        """Share of the query TF-IDF norm carried by n-grams known to the index (unknown ones still count in the norm)"""
+        vocabulary = self.vectorizer.vocabulary_
+        known = unknown = 0.0
+        for gram, count in Counter(self.analyzer(text_norm)).items():
+            col = vocabulary.get(gram)
+            if col is not None:
+                known += (count * self.vectorizer.idf_[col]) ** 2
+            else:
+                unknown += (count * self.unknown_idf) ** 2
+        total = known + unknown
+        return math.sqrt(known / total) if total else 0.0
+
+    def scores(self, text_norm, ids=None):
+        """Cosine similarity of the normalized text against the indexed questions (or only ids)"""
+        from sklearn.metrics.pairwise import cosine_similarity
+
+        query_vec = self.vectorizer.transform([text_norm])
+        matrix = self.matrix if ids is None else self.matrix[ids]
+        return cosine_similarity(query_vec, matrix).flatten() * self.known_weight(text_norm)
+
+def semantic_match(user_msg, questions, answers, index=None, candidates=None):
+    """Enhanced semantic matching"""
+    if not nlp_available or not questions:
+        return None, 0
         
-        tfidf_matrix = vectorizer.fit_transform(corpus)
-        
-        # Calculate cosine similarity
-        sim_scores = cosine_similarity(tfidf_matrix[-1], tfidf_matrix[:-1]).flatten()
+    try:
+        if index is None:
+            corpus = corpus_for(questions)
+            index = corpus.semantic if corpus else SemanticIndex(questions)
+        if index.matrix is None:
+            return None, 0
+
+        # Preprocess user text
+        user_processed = analyze_message(user_msg).normalized
+
+        # Calculate cosine similarity (only against the candidates, when given)
+        if candidates is not None and not candidates:
+            return None, 0
+        sim_scores = index.scores(user_processed, candidates)
         
         best_idx = sim_scores.argmax()
         best_score = sim_scores[best_idx]
+        if candidates is not None:
+            best_idx = candidates[best_idx]
         
         # Higher threshold for semantic matching
         if best_score > 0.35:
@@ -845,116 +1531,366 @@ def semantic_match(user_msg, questions, answers):
         
     return None, 0
 
-def fuzzy_match(user_msg, questions, answers):
+# rapidfuzz worker threads for large score matrices (-1 = all cores)
+FUZZY_WORKERS = int(os.environ.get("FUZZY_WORKERS", -1))
+
+def fuzzy_scores(queries, choices, scorer, score_cutoff):
+    """Score matrix (queries x choices) computed by rapidfuzz in one call"""
+    workers = FUZZY_WORKERS if len(queries) * len(choices) > 10000 else 1
+    return process.cdist(
+        queries, choices, scorer=scorer, score_cutoff=score_cutoff, dtype=np.float64, workers=workers
+    )
+
+def fuzzy_match(user_msg, questions, answers, candidates=None, questions_norm=None):
     """Enhanced fuzzy matching with better thresholds"""
     if not rapidfuzz_available or not questions:
         return None, 0
         
     try:
-        user_processed = normalize(correct_spelling(user_msg))
-        questions_processed = [normalize(q) for q in questions]
-        
-        # Try different fuzzy matching strategies
-        results = process.extractOne(
-            user_processed, 
-            questions_processed, 
-            scorer=fuzz.token_sort_ratio,
-            score_cutoff=70
-        )
-        
-        if results and results[1] > 70:
-            idx = questions_processed.index(results[0])
-            return answers[idx], results[1] / 100.0
-            
-        # Fallback to partial ratio
-        results = process.extractOne(
-            user_processed, 
-            questions_processed, 
-            scorer=fuzz.partial_ratio,
-            score_cutoff=75
-        )
-        
-        if results and results[1] > 75:
-            idx = questions_processed.index(results[0])
-            return answers[idx], results[1] / 100.0
+        user_processed = analyze_message(user_msg).normalized
+        corpus = corpus_for(questions)
+        questions_processed = questions_norm or (corpus.questions_norm if corpus else [normalize(q) for q in questions])
+        pool = candidates if candidates else range(len(questions))
+        choices = [questions_processed[i] for i in pool]
+        
+        # Try different fuzzy matching strategies, then fallback to partial ratio
+        for scorer, cutoff in ((fuzz.token_sort_ratio, 70), (fuzz.partial_ratio, 75)):
+            scores = fuzzy_scores([user_processed], choices, scorer, cutoff)[0]
+            best = int(scores.argmax())
+            if scores[best] > cutoff:
+                return answers[pool[best]], float(scores[best]) / 100.0
             
     except Exception as e:
         print(f"Fuzzy matching error: {e}")
         
     return None, 0
 
+# Number of BM25 candidates handed to the semantic and fuzzy scorers
+BM25_TOP_K = int(os.environ.get("BM25_TOP_K", 50))
+
+class BM25Index(IndexState):
+    """Okapi BM25 inverted index over the normalized corpus questions"""
+    def __init__(self, questions, k1=1.5, b=0.75, normalized=None):
+        self.k1 = k1
+        self.postings = {}
+        self.doc_len = []
+        for idx, question in enumerate(normalized or [normalize(q) for q in questions]):
+            terms = re.findall(r'\w+', question)
+            self.doc_len.append(len(terms))
+            counts = {}
+            for term in terms:
+                counts[term] = counts.get(term, 0) + 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((idx, tf))
+
+        n_docs = len(self.doc_len)
+        avg_len = (sum(self.doc_len) / n_docs) if n_docs else 0
+        # Per-document length normalization of the term frequency
+        self.doc_norm = [k1 * (1 - b + b * length / avg_len) for length in self.doc_len]
+        self.idf = {
+            term: math.log((n_docs - len(p) + 0.5) / (len(p) + 0.5) + 1)
+            for term, p in self.postings.items()
+        }
+
+    def top_k(self, text_norm, k=BM25_TOP_K):
+        """Ids of the k best scoring questions for the normalized text, in corpus order"""
+        scores = {}
+        for term in set(re.findall(r'\w+', text_norm)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for idx, tf in self.postings[term]:
+                score = idf * tf * (self.k1 + 1) / (tf + self.doc_norm[idx])
+                scores[idx] = scores.get(idx, 0) + score
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return sorted(idx for idx, _ in best)
+
+# Optional character n-gram retrieval strategy (CHARGRAM_MATCH=1 enables it)
+CHARGRAM_MATCH = os.environ.get("CHARGRAM_MATCH", "").lower() in ("1", "true", "yes")
+CHARGRAM_THRESHOLD = float(os.environ.get("CHARGRAM_THRESHOLD", 0.65))
+# IVF lists scanned per query: more lists, better recall, slower queries
+CHARGRAM_NPROBE = int(os.environ.get("CHARGRAM_NPROBE", 8))
+
+class CharNgramIndex(IndexState):
+    """Hashed character 3-5 gram vectors of the questions behind an IVF index: scan the closest clusters, re-score exactly"""
+    transient = ("analyzer",)
+
+    def __init__(self, questions, normalized=None, feature_bits=18, sketch_dim=256):
+        self.feature_bits = feature_bits
+        self.sketch_dim = sketch_dim
+        self.restore()
+
+        texts = normalized or [normalize(q) for q in questions]
+        features = [self.features(text) for text in texts]
+        sketches = np.array([sketch for _, _, sketch in features], dtype=np.float32).reshape(-1, sketch_dim)
+
+        # About sqrt(n) inverted lists keeps both the centroid scan and the lists short
+        n_lists = min(len(texts), max(1, int(math.sqrt(len(texts)))))
+        if n_lists > 1:
+            from sklearn.cluster import KMeans
+            kmeans = KMeans(n_clusters=n_lists, n_init=1, random_state=0).fit(sketches)
+            centroids, labels = kmeans.cluster_centers_, kmeans.labels_
+        else:
+            centroids, labels = sketches[:1], np.zeros(len(texts), dtype=np.int64)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        self.centroids = (centroids / np.where(norms > 0, norms, 1)).astype(np.float32)
+
+        # Rows grouped by list: row r of the sketches and CSR arrays is question list_ids[r]
+        self.list_ids = np.argsort(labels, kind="stable").astype(np.int32)
+        self.list_offsets = np.searchsorted(labels[self.list_ids], np.arange(len(self.centroids) + 1))
+        self.sketches = sketches[self.list_ids]
+        rows = [features[idx] for idx in self.list_ids]
+        self.indptr = np.cumsum([0] + [len(cols) for cols, _, _ in rows]).astype(np.int64)
+        self.indices = np.concatenate([cols for cols, _, _ in rows] or [[]]).astype(np.int32)
+        self.data = np.concatenate([vals for _, vals, _ in rows] or [[]]).astype(np.float32)
+
+    def restore(self):
+        from sklearn.feature_extraction.text import HashingVectorizer
+        self.analyzer = HashingVectorizer(analyzer="char_wb", ngram_range=(3, 5)).build_analyzer()
+
+    def features(self, text_norm):
+        """(sorted columns, weights, sketch) of a normalized text, unit vectors; low hash bits give the column, high bits the sketch"""
+        mask = (1 << self.feature_bits) - 1
+        weights = {}
+        sketch = np.zeros(self.sketch_dim, dtype=np.float32)
+        for gram, count in Counter(self.analyzer(text_norm)).items():
+            h = zlib.crc32(gram.encode("utf-8"))
+            weights[h & mask] = weights.get(h & mask, 0) + count
+            sketch[(h >> self.feature_bits) % self.sketch_dim] += count if h >> 31 else -count
+
+        cols = np.array(sorted(weights), dtype=np.int64)
+        vals = np.array([weights[c] for c in cols.tolist()], dtype=np.float32)
+        norm = np.linalg.norm(vals)
+        sketch_norm = np.linalg.norm(sketch)
+        return cols, (vals / norm if norm else vals), (sketch / sketch_norm if sketch_norm else sketch)
+
+    def top_k(self, text_norm, k=1, nprobe=CHARGRAM_NPROBE, rerank=32):
+        """(question ids, cosine scores) of the k nearest questions found in the nprobe closest lists"""
+        cols, vals, sketch = self.features(text_norm)
+        if not len(self.list_ids) or not len(cols):
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+        # Approximate scores on the sketches of the probed lists
+        nprobe = min(nprobe, len(self.centroids))
+        spans = [
+            (self.list_offsets[lst], self.list_offsets[lst + 1])
+            for lst in np.argpartition(self.centroids @ sketch, -nprobe)[-nprobe:]
+        ]
+        rows = np.concatenate([np.arange(start, end) for start, end in spans])
+        approx = np.concatenate([self.sketches[start:end] @ sketch for start, end in spans])
+        if len(rows) > rerank:
+            rows = rows[np.argpartition(-approx, rerank)[:rerank]]
+
+        # Exact cosine of the shortlisted rows
+        query = np.zeros(1 << self.feature_bits, dtype=np.float32)
+        query[cols] = vals
+        scores = np.array([
+            float(query[self.indices[lo:hi]] @ self.data[lo:hi])
+            for lo, hi in zip(self.indptr[rows].tolist(), self.indptr[rows + 1].tolist())
+        ])
+        ids = self.list_ids[rows]
+        # Best score first, corpus order among ties
+        best = np.lexsort((ids, -scores))[:k]
+        return ids[best], scores[best]
+
+def char_ngram_match(user_msg, questions, answers, index=None):
+    """Approximate nearest question on character n-grams"""
+    if not nlp_available or not questions:
+        return None, 0
+
+    try:
+        if index is None:
+            corpus = corpus_for(questions)
+            index = corpus.chargram if corpus and corpus.chargram else CharNgramIndex(questions)
+        ids, scores = index.top_k(analyze_message(user_msg).normalized)
+        if len(ids):
+            return answers[int(ids[0])], float(scores[0])
+    except Exception as e:
+        print(f"Character n-gram matching error: {e}")
+
+    return None, 0
+
+# ===== ADAPTIVE YAML CASCADE =====
+# Default strategy order of the YAML cascade and the score each must beat to answer
+CASCADE_ORDER = ("exact", "keyword", "semantic", "chargram", "fuzzy")
+CASCADE_THRESHOLDS = {"exact": 0.85, "keyword": 0.5, "semantic": 0.4, "chargram": CHARGRAM_THRESHOLD, "fuzzy": 0.75}
+CASCADE_LABELS = {"exact": "Exact", "keyword": "Keyword", "semantic": "Semantic", "chargram": "Character n-gram", "fuzzy": "Fuzzy"}
+
+# ADAPTIVE_CASCADE=1 reorders the cascade per query shape: strategies with
+# ADAPTIVE_MIN_ATTEMPTS attempts trade places so that the most hits per second
+# of matching come first, and those winning less than ADAPTIVE_SKIP_RATE are
+# skipped. Every ADAPTIVE_EXPLORE_EVERY-th query of a shape still runs the
+# default order to keep the statistics of skipped strategies current.
+ADAPTIVE_CASCADE = os.environ.get("ADAPTIVE_CASCADE", "").lower() in ("1", "true", "yes")
+ADAPTIVE_MIN_ATTEMPTS = int(os.environ.get("ADAPTIVE_MIN_ATTEMPTS", 200))
+ADAPTIVE_SKIP_RATE = float(os.environ.get("ADAPTIVE_SKIP_RATE", 0.005))
+ADAPTIVE_EXPLORE_EVERY = int(os.environ.get("ADAPTIVE_EXPLORE_EVERY", 20))
+
+def query_shape(analysis):
+    """Coarse shape of a message for the cascade statistics: short (greetings), medium or long"""
+    n = len(analysis.tokens)
+    return "short" if n <= 3 else "medium" if n <= 8 else "long"
+
+class CascadeStats:
+    """Thread-safe per-shape hit rate and cost of every cascade strategy, and the order they imply"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.queries = Counter()
+            self.unmatched = Counter()
+            self.attempts = Counter()
+            self.hits = Counter()
+            self.seconds = Counter()
+
+    def record(self, shape, strategy, hit, seconds):
+        with self.lock:
+            key = (shape, strategy)
+            self.attempts[key] += 1
+            self.hits[key] += hit
+            self.seconds[key] += seconds
+
+    def finish(self, shape, matched):
+        with self.lock:
+            self.queries[shape] += 1
+            self.unmatched[shape] += not matched
+
+    def adapted_order(self, shape, strategies):
+        """Measured strategies by hits per second within their slots, rare winners dropped (None while none is measured)"""
+        with self.lock:
+            measured = [s for s in strategies if self.attempts[shape, s] >= ADAPTIVE_MIN_ATTEMPTS]
+            rates = {s: self.hits[shape, s] / self.attempts[shape, s] for s in measured}
+            costs = {s: self.seconds[shape, s] / self.attempts[shape, s] for s in measured}
+        if not measured:
+            return None
+        ranked = iter(sorted(measured, key=lambda s: (-rates[s] / max(costs[s], 1e-9), strategies.index(s))))
+        order = [next(ranked) if s in rates else s for s in strategies]
+        return [s for s in order if s not in rates or rates[s] >= ADAPTIVE_SKIP_RATE] or list(strategies)
+
+    def plan(self, shape, strategies):
+        """Order in which the cascade runs the strategies for a query of this shape"""
+        if not ADAPTIVE_CASCADE:
+            return strategies
+        with self.lock:
+            explore = ADAPTIVE_EXPLORE_EVERY > 0 and self.queries[shape] % ADAPTIVE_EXPLORE_EVERY == 0
+        return (None if explore else self.adapted_order(shape, strategies)) or strategies
+
+    def snapshot(self):
+        """Statistics and current order per shape, for tuning"""
+        with self.lock:
+            shapes = sorted(set(self.queries) | {shape for shape, _ in self.attempts})
+            stats = {}
+            for shape in shapes:
+                stats[shape] = {
+                    "queries": self.queries[shape],
+                    "unmatched": self.unmatched[shape],
+                    "strategies": {
+                        s: {
+                            "attempts": self.attempts[shape, s],
+                            "hits": self.hits[shape, s],
+                            "hit_rate": round(self.hits[shape, s] / self.attempts[shape, s], 3),
+                            "mean_ms": round(1000 * self.seconds[shape, s] / self.attempts[shape, s], 3)
+                        }
+                        for s in CASCADE_ORDER if self.attempts[shape, s]
+                    }
+                }
+        strategies = [s for s in CASCADE_ORDER if s != "chargram" or CHARGRAM_MATCH]
+        for shape in stats:
+            stats[shape]["order"] = self.adapted_order(shape, strategies) or strategies
+        return {"adaptive": ADAPTIVE_CASCADE, "thresholds": CASCADE_THRESHOLDS, "shapes": stats}
+
+cascade_stats = CascadeStats()
+
 def match_yaml_qa_ai(user_msg):
     """Enhanced YAML Q&A matching with multiple strategies"""
-    if not user_msg or not qa_questions:
-        return None
-        
-    # Preprocess user message
-    msg_corr = correct_spelling(user_msg)
-    
-    print(f"Original: '{user_msg}' -> Corrected: '{msg_corr}'")
-    
-    # Strategy 1: Intelligent exact matching
-    answer, score = intelligent_exact_match(msg_corr, qa_questions, qa_answers)
-    if answer and score > 0.85:
-        print(f"Exact match found with score: {score}")
-        return answer
-    
-    # Strategy 2: Enhanced keyword matching
-    answer, score = enhanced_keyword_match(msg_corr, qa_questions, qa_answers)
-    if answer and score > 0.5:
-        print(f"Keyword match found with score: {score}")
-        return answer
-    
-    # Strategy 3: Semantic similarity matching
-    answer, score = semantic_match(msg_corr, qa_questions, qa_answers)
-    if answer and score > 0.4:
-        print(f"Semantic match found with score: {score}")
-        return answer
-        
-    # Strategy 4: Fuzzy matching as last resort
-    answer, score = fuzzy_match(msg_corr, qa_questions, qa_answers)
-    if answer and score > 0.75:
-        print(f"Fuzzy match found with score: {score}")
-        return answer
-    
+    return match_yaml_qa_scored(user_msg)[0]
+
+def match_yaml_qa_scored(user_msg):
+    """YAML Q&A matching returning (answer, strategy, score); (None, None, 0) without a match"""
+    # One consistent corpus for every strategy, even if a reload swaps it meanwhile
+    corpus = corpus_index
+    if not user_msg or corpus is None or not corpus.questions:
+        return None, None, 0
+    questions, answers = corpus.questions, corpus.answers
+        
+    # Preprocess user message once for every strategy
+    analysis = analyze_message(user_msg)
+    
+    print(f"Original: '{analysis.text}' -> Corrected: '{analysis.corrected}'")
+
+    # Top BM25 candidates for semantic and fuzzy matching, computed on first use;
+    # exact and keyword strategies use their own indexes
+    bm25 = []
+    def candidates():
+        if not bm25:
+            bm25.append(corpus.bm25.top_k(analysis.normalized))
+        return bm25[0]
+
+    strategies = {
+        "exact": lambda: intelligent_exact_match(analysis, questions, answers, index=corpus.exact),
+        "keyword": lambda: enhanced_keyword_match(analysis, questions, answers, index=corpus.keywords),
+        "semantic": lambda: semantic_match(analysis, questions, answers, index=corpus.semantic, candidates=candidates()),
+        # Character n-gram nearest neighbour (optional)
+        "chargram": lambda: char_ngram_match(analysis, questions, answers, index=corpus.chargram),
+        # Fuzzy matching as last resort
+        # (falls back to the whole corpus when no question shares a term)
+        "fuzzy": lambda: fuzzy_match(analysis, questions, answers, candidates=candidates(), questions_norm=corpus.questions_norm)
+    }
+    available = [s for s in CASCADE_ORDER if s != "chargram" or corpus.chargram is not None]
+
+    shape = query_shape(analysis)
+    for name in cascade_stats.plan(shape, available):
+        start = time.perf_counter()
+        answer, score = strategies[name]()
+        hit = bool(answer and score > CASCADE_THRESHOLDS[name])
+        cascade_stats.record(shape, name, hit, time.perf_counter() - start)
+        if hit:
+            print(f"{CASCADE_LABELS[name]} match found with score: {score}")
+            cascade_stats.finish(shape, True)
+            return answer, name, score
+
+    cascade_stats.finish(shape, False)
     print("No match found in YAML corpus")
-    return None
+    return None, None, 0
+
+# Words that mark a message as Italian
+ITALIAN_KEYWORDS = [
+    "ciao", "come", "puoi", "aiutarmi", "grazie", "prenotare", "test", "udito", "orari", "info", 
+    "salve", "quanto", "dove", "chi", "cosa", "quale", "azienda", "giorno", "ora", "bot", 
+    "servizio", "prenotazione", "farmacia", "farmacie", "indirizzo", "telefono", "email", 
+    "cap", "provincia", "regione", "otobot", "assistente", "apparecchi", "acustici", 
+    "ricaricabili", "garanzia", "prezzo", "pagare", "prova", "fastidio", "orecchio", 
+    "caccia", "collegano", "perdere", "acqua", "teleaudiologia", "gratis", "mese", 
+    "assistenza", "costano", "online", "resistenti", "vedere", "danno", "voglio", 
+    "parlarne", "familiare", "succede", "metto", "sono", "che", "tipo", "tipi",
+    "inclusa", "incluso", "servizi", "consulenza", "supporto", "aiuto", "quando",
+    "perché", "perche", "qualità", "qualita", "migliore", "migliori", "buono",
+    "buona", "buoni", "buone", "bene", "male", "meglio", "peggio", "prima", "dopo"
+]
+# The same words stemmed, for the keyword check
+ITALIAN_KEYWORD_STEMS = frozenset(italian_stem(w) for w in ITALIAN_KEYWORDS)
 
 def is_probably_italian(text):
     """Enhanced Italian language detection"""
     if not text:
         return False
         
-    text_corr = correct_spelling(text)
-    text_lc = text_corr.lower()
-    
-    # Italian keywords
-    italian_keywords = [
-        "ciao", "come", "puoi", "aiutarmi", "grazie", "prenotare", "test", "udito", "orari", "info", 
-        "salve", "quanto", "dove", "chi", "cosa", "quale", "azienda", "giorno", "ora", "bot", 
-        "servizio", "prenotazione", "farmacia", "farmacie", "indirizzo", "telefono", "email", 
-        "cap", "provincia", "regione", "otobot", "assistente", "apparecchi", "acustici", 
-        "ricaricabili", "garanzia", "prezzo", "pagare", "prova", "fastidio", "orecchio", 
-        "caccia", "collegano", "perdere", "acqua", "teleaudiologia", "gratis", "mese", 
-        "assistenza", "costano", "online", "resistenti", "vedere", "danno", "voglio", 
-        "parlarne", "familiare", "succede", "metto", "sono", "che", "tipo", "tipi",
-        "inclusa", "incluso", "servizi", "consulenza", "supporto", "aiuto", "quando",
-        "perché", "perche", "qualità", "qualita", "migliore", "migliori", "buono",
-        "buona", "buoni", "buone", "bene", "male", "meglio", "peggio", "prima", "dopo"
-    ]
+    analysis = analyze_message(text)
+    text_lc = analysis.corrected.lower()
     
     # Count Italian keyword matches
-    matches = sum(1 for kw in italian_keywords if kw in text_lc)
+    matches = sum(1 for kw in ITALIAN_KEYWORDS if kw in text_lc)
     
     # Enhanced detection
     if matches > 0:
         return True
     
     # Check for Italian word patterns
-    msg_keywords = extract_keywords(text_corr)
-    italian_keywords_set = set(italian_keywords)
+    msg_keywords = analysis.keywords
     
-    if len(msg_keywords & italian_keywords_set) > 0:
+    if len(msg_keywords & ITALIAN_KEYWORD_STEMS) > 0:
         return True
     
     # Check against English patterns
@@ -984,11 +1920,11 @@ def detect_precise_assistant_name(msg):
     if not msg:
         return False
         
-    msg_corr = correct_spelling(msg)
-    msg_lc = normalize(msg_corr).strip()
+    analysis = analyze_message(msg)
+    msg_lc = analysis.normalized
     
     # Exact word matching for precise activation
-    words = msg_lc.split()
+    words = analysis.tokens
     
     # Check for exact "otobot" at start or end of message
     if words and (words[0] == "otobot" or words[-1] == "otobot"):
@@ -1006,16 +1942,14 @@ def detect_precise_assistant_name(msg):
             return True
     
     # Precise pattern matching
-    for pattern in PRECISE_ASSISTANT_NAME_PATTERNS:
-        if re.search(pattern, msg_lc):
-            return True
+    if PRECISE_ASSISTANT_NAME_BANK.search(msg_lc):
+        return True
     
     # Extended pattern matching with context
-    for pattern in EXTENDED_ASSISTANT_NAME_PATTERNS:
-        if re.search(pattern, msg_lc):
-            context_words = {"assistente", "virtuale", "otofarma", "spa"}
-            if any(word in msg_lc for word in context_words):
-                return True
+    if EXTENDED_ASSISTANT_NAME_BANK.search(msg_lc):
+        context_words = {"assistente", "virtuale", "otofarma", "spa"}
+        if any(word in msg_lc for word in context_words):
+            return True
     
     return False
 
@@ -1032,20 +1966,16 @@ def detect_time_or_date_question(msg):
     if not msg:
         return None
         
-    msg_corr = correct_spelling(msg)
-    msg_lc = normalize(msg_corr).strip()
+    analysis = analyze_message(msg)
+    msg_lc = analysis.normalized
     
     # Must be very specific to avoid false positives
-    for pat in FUZZY_TIME_PATTERNS:
-        if re.match(pat, msg_lc):
-            return "time"
-    
-    for pat in FUZZY_DATE_PATTERNS:
-        if re.match(pat, msg_lc):
-            return "date"
+    kind = TIME_DATE_BANK.search(msg_lc)
+    if kind:
+        return kind
     
     # Check for very short queries
-    tokens = msg_lc.split()
+    tokens = analysis.tokens
     if len(tokens) <= 2:
         if tokens and tokens[0] in ["ora", "orario"]:
             return "time"
@@ -1059,23 +1989,22 @@ def detect_office_hours_question(msg):
     if not msg:
         return False
         
-    msg_corr = correct_spelling(msg)
-    msg_lc = normalize(msg_corr)
+    analysis = analyze_message(msg)
+    msg_lc = analysis.normalized
     
     # Skip if it's asking for assistant name or general patterns
-    if detect_assistant_name(msg_lc):
+    if detect_assistant_name(analysis):
         return False
         
-    if check_general_patterns(msg_lc):
+    if check_general_patterns(analysis):
         return False
     
     # Check specific office hour patterns
-    for pat in OFFICE_PATTERNS:
-        if re.search(pat, msg_lc):
-            return True
+    if OFFICE_BANK.search(msg_lc):
+        return True
     
     # Check for office keywords
-    tokens = set(msg_lc.split())
+    tokens = set(analysis.tokens)
     office_matches = tokens & OFFICE_KEYWORDS
     
     # Need at least 2 relevant words for office hours
@@ -1130,10 +2059,11 @@ def check_general_patterns(user_msg):
     if not user_msg:
         return None
         
-    msg = normalize(correct_spelling(user_msg))
+    analysis = analyze_message(user_msg)
+    msg = analysis.normalized
     
     # Skip if asking for assistant name
-    if detect_assistant_name(msg):
+    if detect_assistant_name(analysis):
         return None
     
     # Stricter greeting matching: only match exact short greetings or "come va"/"come stai" as whole phrase
@@ -1146,7 +2076,7 @@ def check_general_patterns(user_msg):
                 return reply
 
     # Check for standalone greetings
-    tokens = msg.split()
+    tokens = analysis.tokens
     if len(tokens) == 1 and tokens[0] in ["ciao", "salve", "buongiorno", "buonasera", "buonanotte"]:
         return "Salve! Sono qui per aiutarti in tutto ciò che riguarda Otofarma."
 
@@ -1159,13 +2089,9 @@ def detect_corporate_question(msg):
     if not msg:
         return None
         
-    msg_lc = normalize(msg)
+    msg_lc = normalized_text(msg)
     
-    for pattern, topic in CORPORATE_PATTERNS:
-        if re.search(pattern, msg_lc, re.IGNORECASE):
-            return topic
-    
-    return None
+    return CORPORATE_BANK.search(msg_lc)
 
 def get_headquarters_info():
     """Professional headquarters information"""
@@ -1371,7 +2297,7 @@ def get_architecture_info():
 pharmacies = []
 if os.path.isfile(PHARMACY_CSV_PATH):
     try:
-        with open(PHARMACY_CSV_PATH, encoding="utf-8") as f:
+        with boot_profiler.phase("pharmacy_csv"), open(PHARMACY_CSV_PATH, encoding="utf-8") as f:
             reader = csv.DictReader(f, delimiter=';' if PHARMACY_CSV_PATH.lower().endswith('.csv') else ',')
             for row in reader:
                 pharmacies.append(row)
@@ -1384,12 +2310,304 @@ else:
     print(f"File CSV farmacie non trovato: {PHARMACY_CSV_PATH}")
     logger.warning(f"⚠️ Pharmacy CSV file not found: {PHARMACY_CSV_PATH}")
 
+# ===== CORPUS INDEX AND STARTUP SNAPSHOT =====
+class CorpusIndex(IndexState):
+    """Q&A pairs of the YAML corpus with every search structure built over them"""
+    nested = {
+        "exact": ExactMatchIndex, "keywords": KeywordIndex, "semantic": SemanticIndex,
+        "bm25": BM25Index, "chargram": CharNgramIndex
+    }
+    transient = ("pairs", "questions", "answers")
+
+    def __init__(self, files, previous=None):
+        """files maps each YAML path to (mtime, pairs); per-question work and exact-match postings are reused from previous"""
+        self.files = files
+        self.restore()
+
+        old_ids = {q: i for i, q in enumerate(previous.questions)} if previous else {}
+
+        def carry(old_values, compute):
+            return [old_values[old_ids[q]] if q in old_ids else compute(q) for q in self.questions]
+
+        self.questions_norm = carry(previous and previous.questions_norm, normalize)
+        self.exact = ExactMatchIndex(self.questions, normalized=self.questions_norm, previous=previous and previous.exact)
+        self.keywords = KeywordIndex(
+            self.questions, keywords=carry(previous and previous.keywords.keywords, extract_keywords)
+        )
+        self.semantic = SemanticIndex(self.questions, normalized=self.questions_norm)
+        self.bm25 = BM25Index(self.questions, normalized=self.questions_norm)
+        self.chargram = None
+        if CHARGRAM_MATCH and nlp_available:
+            self.chargram = CharNgramIndex(self.questions, normalized=self.questions_norm)
+
+    def restore(self):
+        self.pairs = [pair for _, file_pairs in self.files.values() for pair in file_pairs]
+        self.questions = [q for q, _ in self.pairs]
+        self.answers = [a for _, a in self.pairs]
+
+def install_corpus(corpus):
+    """Swap in a CorpusIndex (a single reference, so requests see either the old or the new one)"""
+    global corpus_index, all_qa_pairs, qa_questions, qa_answers
+    corpus_index = corpus
+    all_qa_pairs = corpus.pairs
+    qa_questions = corpus.questions
+    qa_answers = corpus.answers
+
+# Compiled corpus + spelling index, memory-mapped at boot instead of parsing YAML.
+# Build it at deploy time with `python build_corpus.py`.
+CORPUS_SNAPSHOT_PATH = os.environ.get(
+    "CORPUS_SNAPSHOT_PATH",
+    os.path.join(os.path.dirname(__file__), "corpus_snapshot.bin")
+)
+CORPUS_SNAPSHOT_MAGIC = b"OTOCORP1"
+CORPUS_SNAPSHOT_ALIGN = 64
+
+def corpus_snapshot_sources(corpus=None):
+    """Modification time of every file the compiled corpus is built from (as indexed in corpus, or on disk)"""
+    if corpus is not None:
+        sources = {path: mtime for path, (mtime, _) in corpus.files.items()}
+    else:
+        sources = corpus_yaml_files()
+    if os.path.isfile(PHARMACY_CSV_PATH):
+        sources[os.path.abspath(PHARMACY_CSV_PATH)] = os.path.getmtime(PHARMACY_CSV_PATH)
+    return sources
+
+def corpus_snapshot_build_info():
+    """Everything besides the source files that changes what the snapshot contains"""
+    return {
+        "format": 3,
+        "python": list(sys.version_info[:2]),
+        "sklearn": sklearn_version if nlp_available else None,
+        "chargram": CHARGRAM_MATCH,
+        "spelling": spellchecker_available and rapidfuzz_available
+    }
+
+def save_corpus_snapshot(corpus, spelling, path=CORPUS_SNAPSHOT_PATH):
+    """Write the snapshot: a header, a pickled payload and its array buffers at aligned offsets"""
+    meta = pickle.dumps(
+        {"build": corpus_snapshot_build_info(), "sources": corpus_snapshot_sources(corpus)}, protocol=5
+    )
+    buffers = []
+    payload = pickle.dumps(
+        {"corpus": corpus.to_state(), "spelling": spelling.to_state() if spelling else None},
+        protocol=5, buffer_callback=buffers.append
+    )
+    raws = [buffer.raw() for buffer in buffers]
+
+    def aligned(offset):
+        return -(-offset // CORPUS_SNAPSHOT_ALIGN) * CORPUS_SNAPSHOT_ALIGN
+
+    offset = aligned(len(CORPUS_SNAPSHOT_MAGIC) + 24 + 16 * len(raws) + len(meta) + len(payload))
+    layout = []
+    for raw in raws:
+        layout.append((offset, raw.nbytes))
+        offset = aligned(offset + raw.nbytes)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CORPUS_SNAPSHOT_MAGIC)
+        f.write(struct.pack("<QQQ", len(meta), len(payload), len(raws)))
+        for buffer_offset, size in layout:
+            f.write(struct.pack("<QQ", buffer_offset, size))
+        f.write(meta)
+        f.write(payload)
+        for (buffer_offset, _), raw in zip(layout, raws):
+            f.write(b"\0" * (buffer_offset - f.tell()))
+            f.write(raw)
+    os.replace(tmp_path, path)
+
+def load_corpus_snapshot(path=CORPUS_SNAPSHOT_PATH):
+    """Memory-map the snapshot, arrays as read-only views; None when it is missing, incompatible or stale"""
+    if not os.path.isfile(path):
+        return None
+
+    with open(path, "rb") as f:
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    pos = len(CORPUS_SNAPSHOT_MAGIC)
+    if bytes(view[:pos]) != CORPUS_SNAPSHOT_MAGIC:
+        raise ValueError("not a corpus snapshot")
+    meta_len, payload_len, n_buffers = struct.unpack_from("<QQQ", view, pos)
+    pos += 24
+    layout = [struct.unpack_from("<QQ", view, pos + 16 * i) for i in range(n_buffers)]
+    pos += 16 * n_buffers
+
+    meta = pickle.loads(view[pos:pos + meta_len])
+    if meta["build"] != corpus_snapshot_build_info():
+        print(f"Corpus snapshot {path} was built with a different setup, rebuilding")
+        return None
+    sources = corpus_snapshot_sources()
+    if set(sources) != set(meta["sources"]) or any(sources[p] > meta["sources"][p] for p in sources):
+        print(f"Corpus files changed since {path} was built, rebuilding")
+        return None
+
+    pos += meta_len
+    buffers = [view[offset:offset + size] for offset, size in layout]
+    return pickle.loads(view[pos:pos + payload_len], buffers=buffers)
+
+def boot_corpus():
+    """Install the corpus and spelling index from the snapshot, or compile them from the sources"""
+    global spelling_index
+    start = time.time()
+    payload = None
+    if os.environ.get("CORPUS_SNAPSHOT_REBUILD", "").lower() not in ("1", "true", "yes"):
+        try:
+            with boot_profiler.phase("corpus_snapshot_load"):
+                payload = load_corpus_snapshot()
+        except Exception as e:
+            logger.warning(f"Could not load corpus snapshot {CORPUS_SNAPSHOT_PATH}: {e}")
+
+    if payload:
+        install_corpus(CorpusIndex.from_state(payload["corpus"]))
+        spelling_index = SymSpellIndex.from_state(payload["spelling"]) if payload["spelling"] else None
+        print(f"Loaded {len(qa_questions)} Q&A pairs from corpus snapshot in {time.time() - start:.2f}s")
+    else:
+        with boot_profiler.phase("corpus_compile"):
+            corpus = CorpusIndex(load_yaml_corpus())
+            install_corpus(corpus)
+        # Spelling index needs the corpus and the pharmacy vocabulary, both loaded by now
+        with boot_profiler.phase("spelling_index"):
+            spelling_index = build_spelling_index(corpus)
+        print(f"Compiled corpus indexes in {time.time() - start:.1f}s")
+        try:
+            with boot_profiler.phase("corpus_snapshot_save"):
+                save_corpus_snapshot(corpus, spelling_index)
+            print(f"Saved corpus snapshot to {CORPUS_SNAPSHOT_PATH}")
+        except Exception as e:
+            logger.warning(f"Could not write corpus snapshot {CORPUS_SNAPSHOT_PATH}: {e}")
+    invalidate_spelling_caches()
+
+def load_matching():
+    """Corpus, spelling index, pharmacy BallTree and the libraries the matchers import on first use"""
+    if nlp_available:
+        # The snapshot's TF-IDF models need scikit-learn to unpickle: import it first so it is timed on its own
+        with boot_profiler.phase("sklearn_import"):
+            import sklearn.feature_extraction.text  # noqa: F401
+            import sklearn.metrics.pairwise  # noqa: F401  (semantic_match)
+    try:
+        boot_corpus()
+    except Exception as e:
+        logger.error(f"❌ Error loading Q&A corpus: {e}")
+    if nlp_available:
+        try:
+            with boot_profiler.phase("pharmacy_tree"):
+                pharmacy_locator.build_tree()
+        except Exception as e:
+            logger.warning(f"Could not build the pharmacy BallTree, nearest pharmacies are found by a scan: {e}")
+
+# The warm-up thread started at the end of this module loads the corpus, so
+# the server answers / and static files while it loads; handlers that match
+# messages call wait_for_corpus() first and answer 503 if it is still loading.
+# Keep CORPUS_WAIT_TIMEOUT under the gunicorn worker timeout (30 s by default).
+CORPUS_READY = threading.Event()
+CORPUS_WAIT_TIMEOUT = float(os.environ.get("CORPUS_WAIT_TIMEOUT", 20))
+
+def wait_for_corpus(timeout=CORPUS_WAIT_TIMEOUT):
+    """Block until the corpus is loaded (True), or the timeout expires first (False)"""
+    return CORPUS_READY.wait(timeout)
+
+def warming_up():
+    """503 reply for a request that arrived before the corpus finished loading"""
+    response = jsonify({"error": "warming up", "reply": "Mi sto ancora preparando: riprova tra qualche secondo."})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+# Seconds between two checks of the corpus files (0 disables hot reload)
+CORPUS_RELOAD_INTERVAL = float(os.environ.get("CORPUS_RELOAD_INTERVAL", 5))
+CORPUS_RELOAD_LOCK = threading.Lock()
+
+def reload_corpus():
+    """Re-index the changed YAML files and swap the new index in (TF-IDF, BM25 and n-gram clusters are refit: their statistics are corpus-wide); number of files changed"""
+    global spelling_index
+    with CORPUS_RELOAD_LOCK:
+        previous = corpus_index
+        on_disk = corpus_yaml_files()
+        changed = [p for p, mtime in on_disk.items() if p not in previous.files or previous.files[p][0] != mtime]
+        removed = [p for p in previous.files if p not in on_disk]
+        if not changed and not removed:
+            return 0
+
+        start = time.time()
+        files = {}
+        for path, mtime in on_disk.items():
+            if path not in changed:
+                files[path] = previous.files[path]
+                continue
+            try:
+                files[path] = (mtime, parse_yaml_corpus_file(path))
+            except Exception as e:
+                # Keep serving the last good version until the file is saved again
+                logger.warning(f"⚠️ Failed to parse {path}, keeping its previous Q&A pairs: {e}")
+                files[path] = (mtime, previous.files[path][1] if path in previous.files else [])
+        parsed = time.time()
+
+        corpus = CorpusIndex(files, previous)
+        indexed = time.time()
+        spelling = spelling_index.updated(spelling_vocabulary(corpus)) if spelling_index is not None else None
+        spelled = time.time()
+
+        install_corpus(corpus)
+        spelling_index = spelling
+        invalidate_spelling_caches()
+
+        old_questions = set(previous.questions)
+        new_questions = sum(1 for q in corpus.questions if q not in old_questions)
+        logger.info(
+            f"🔄 Corpus reloaded in {(spelled - start) * 1000:.0f}ms "
+            f"(parse {(parsed - start) * 1000:.0f}ms, index {(indexed - parsed) * 1000:.0f}ms, "
+            f"spelling {(spelled - indexed) * 1000:.0f}ms): {len(changed)} changed and {len(removed)} "
+            f"removed files, {len(corpus.questions)} Q&A pairs ({new_questions} new questions)"
+        )
+
+        try:
+            save_corpus_snapshot(corpus, spelling)
+        except Exception as e:
+            logger.warning(f"Could not write corpus snapshot {CORPUS_SNAPSHOT_PATH}: {e}")
+        return len(changed) + len(removed)
+
+def watch_corpus(interval=CORPUS_RELOAD_INTERVAL):
+    """Poll the corpus files and hot-reload the ones that change"""
+    while True:
+        time.sleep(interval)
+        try:
+            if corpus_index is not None:
+                reload_corpus()
+        except Exception as e:
+            logger.error(f"❌ Corpus reload failed: {e}")
+
+# Advanced pattern matching for pharmacy voice queries - ENHANCED FOR "WHAT/WHICH" QUESTIONS
+PHARMACY_VOICE_PATTERNS = [
+    r"\b(dove\s+(sono|si\s+trovano|posso\s+trovare).*(farmacie?|otofarma))\b",
+    r"\b(farmacie?.*\s+(milano|roma|napoli|torino|firenze|bologna|venezia|genova|palermo|bari|catania|brescia|verona|padova|trieste|taranto|reggio|modena|prato|parma))\b",
+    r"\b(cerco\s+(una\s+)?farmacie?)\b",
+    r"\b(ci\s+sono.*farmacie?.*\s+(a|in|su|per|di))\b",
+    r"\b(mostra.*farmacie?)\b",
+    r"\b(dimmi.*farmacie?)\b",
+    r"\b(qual.*farmacie?.*vicin)\b",
+    r"\b(dove.*otofarma)\b",
+    # ENHANCED PATTERNS FOR "WHAT/WHICH ARE PHARMACIES"
+    r"\b(quali?\s+(sono|sono\s+le)\s+farmacie?)\b",
+    r"\b(what\s+are\s+.*(pharmacy|pharmacies))\b",
+    r"\b(which\s+are\s+.*(pharmacy|pharmacies))\b",
+    r"\b(cosa\s+sono\s+.*farmacie?)\b",
+    r"\b(che\s+farmacie?)\b",
+    r"\b(elenco.*farmacie?)\b",
+    r"\b(lista.*farmacie?)\b",
+    r"\b(elenca.*farmacie?)\b",
+    # NEW COMPREHENSIVE PATTERNS
+    r"\b(quali?\s+farmacie?\s+(ci\s+sono|sono|esistono|sono\s+presenti))\b",
+    r"\b(farmacie?\s+(a|in|di)\s+(milano|roma|napoli|torino|firenze|bologna|venezia|genova|palermo|bari|catania|brescia|verona|padova))\b",
+    r"\b(which\s+farmacie?)\b",
+    r"\b(what\s+farmacie?)\b"
+]
+PHARMACY_VOICE_BANK = pattern_bank("pharmacy_voice", PHARMACY_VOICE_PATTERNS, flags=re.IGNORECASE)
+
 def is_pharmacy_question(msg):
     """Enhanced pharmacy question detection for voice assistant"""
     if not msg:
         return False
         
-    msg_lc = normalize(msg)
+    msg_lc = normalized_text(msg)
     
     # Primary pharmacy keywords (high confidence)
     primary_keywords = ["farmacia", "farmacie", "otofarma", "pharmacy", "pharmacies"]
@@ -1426,36 +2644,9 @@ def is_pharmacy_question(msg):
     has_place = any(kw in msg_lc for kw in place_keywords)
     has_contact_intent = any(kw in msg_lc for kw in contact_keywords)
     
-    # Advanced pattern matching for voice queries - ENHANCED FOR "WHAT/WHICH" QUESTIONS
-    voice_patterns = [
-        r"\b(dove\s+(sono|si\s+trovano|posso\s+trovare).*(farmacie?|otofarma))\b",
-        r"\b(farmacie?.*\s+(milano|roma|napoli|torino|firenze|bologna|venezia|genova|palermo|bari|catania|brescia|verona|padova|trieste|taranto|reggio|modena|prato|parma))\b",
-        r"\b(cerco\s+(una\s+)?farmacie?)\b",
-        r"\b(ci\s+sono.*farmacie?.*\s+(a|in|su|per|di))\b",
-        r"\b(mostra.*farmacie?)\b",
-        r"\b(dimmi.*farmacie?)\b",
-        r"\b(qual.*farmacie?.*vicin)\b",
-        r"\b(dove.*otofarma)\b",
-        # ENHANCED PATTERNS FOR "WHAT/WHICH ARE PHARMACIES"
-        r"\b(quali?\s+(sono|sono\s+le)\s+farmacie?)\b",
-        r"\b(what\s+are\s+.*(pharmacy|pharmacies))\b",
-        r"\b(which\s+are\s+.*(pharmacy|pharmacies))\b",
-        r"\b(cosa\s+sono\s+.*farmacie?)\b",
-        r"\b(che\s+farmacie?)\b",
-        r"\b(elenco.*farmacie?)\b",
-        r"\b(lista.*farmacie?)\b",
-        r"\b(elenca.*farmacie?)\b",
-        # NEW COMPREHENSIVE PATTERNS
-        r"\b(quali?\s+farmacie?\s+(ci\s+sono|sono|esistono|sono\s+presenti))\b",
-        r"\b(farmacie?\s+(a|in|di)\s+(milano|roma|napoli|torino|firenze|bologna|venezia|genova|palermo|bari|catania|brescia|verona|padova))\b",
-        r"\b(which\s+farmacie?)\b",
-        r"\b(what\s+farmacie?)\b"
-    ]
-    
-    # Check voice patterns
-    for pattern in voice_patterns:
-        if re.search(pattern, msg_lc, re.IGNORECASE):
-            return True
+    # Advanced pattern matching for voice queries
+    if PHARMACY_VOICE_BANK.search(msg_lc):
+        return True
     
     # Scoring system for better detection
     score = 0
@@ -1470,28 +2661,125 @@ def is_pharmacy_question(msg):
         
     return score >= 3
 
-def extract_city_from_query(user_msg):
-    """Advanced city extraction from voice queries"""
-    user_msg_norm = normalize(user_msg)
-    
-    # Get all possible cities from CSV
-    city_keys = ['Città', 'città', 'city', 'City', 'CITTÀ']
-    cities_original = set()
-    
+PHARMACY_CITY_KEYS = ['Città', 'città', 'city', 'City', 'CITTÀ']
+
+class AhoCorasick:
+    """Automaton finding every occurrence of a set of non-empty strings in one pass over a text"""
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for word in words:
+            state = 0
+            for ch in word:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = nxt
+            self.output[state] = (word,)
+
+        # Breadth-first, so the failure state of a node is complete before its children need it
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] += self.output[self.fail[nxt]]
+
+    def matches(self, text):
+        """(start, end, word) of every occurrence of a word in text, by end position"""
+        state = 0
+        goto, fail, output = self.goto, self.fail, self.output
+        for end, ch in enumerate(text, 1):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for word in output[state]:
+                yield end - len(word), end, word
+
+class CityRecognizer:
+    """Normalized pharmacy cities found as whole words in one Aho-Corasick pass, longest overlap wins"""
+    def __init__(self, cities):
+        # normalized name -> name as spelled in the CSV (first spelling wins)
+        self.names = {}
+        for city in cities:
+            self.names.setdefault(normalize(city), city)
+        self.names.pop("", None)
+        self.cities = set(self.names.values())
+        self.automaton = AhoCorasick(self.names)
+
+    def find(self, text):
+        """CSV spelling of the cities mentioned in normalized text, in the order they appear"""
+        mentions = [
+            (start, end, name) for start, end, name in self.automaton.matches(text)
+            if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+        ]
+
+        chosen = []
+        for start, end, name in sorted(mentions, key=lambda m: (m[0] - m[1], m[0])):
+            if all(end <= s or start >= e for s, e, _ in chosen):
+                chosen.append((start, end, name))
+        return list(dict.fromkeys(self.names[name] for _, _, name in sorted(chosen)))
+
+def pharmacy_cities():
+    """City of every pharmacy, as spelled in the CSV"""
     for ph in pharmacies:
-        for key in city_keys:
+        for key in PHARMACY_CITY_KEYS:
             city = ph.get(key, "")
             if city and city.strip():
-                cities_original.add(city.strip())
-    
-    # Create normalized mapping
-    cities_map = {normalize(city): city for city in cities_original}
-    found_cities = []
+                yield city.strip()
+
+with boot_profiler.phase("city_recognizer"):
+    city_recognizer = CityRecognizer(pharmacy_cities())
+
+# (column, CSV header, alternative header) of the normalized pharmacy columns
+PHARMACY_COLUMNS = (
+    ("name", "Farmacia", "Nome"),
+    ("city", "Città", "città"),
+    ("province", "Provincia", "provincia"),
+    ("cap", "CAP", "cap"),
+    ("region", "Regione", "regione"),
+)
+# Score of a pharmacy for each of its columns found in the message
+PHARMACY_MATCH_WEIGHTS = (("name", 4), ("city", 3), ("province", 2), ("cap", 2), ("region", 1))
+
+class PharmacyIndex:
+    """Normalized pharmacy columns, the row ids of every distinct value (groups[column][value]) and an automaton over the values"""
+    def __init__(self, rows):
+        self.rows = rows
+        self.columns = {
+            column: [normalize(ph.get(header, ph.get(alternative, ""))) for ph in rows]
+            for column, header, alternative in PHARMACY_COLUMNS
+        }
+        self.groups = {}
+        for column, values in self.columns.items():
+            groups = self.groups[column] = {}
+            for row_id, value in enumerate(values):
+                groups.setdefault(value, []).append(row_id)
+        self.values = AhoCorasick({value for groups in self.groups.values() for value in groups if value})
+        self.cities = sorted(set(pharmacy_cities()))
+
+    def lookup(self, field, value):
+        """Pharmacies whose field ("city", "province", "cap", ...) normalizes like value"""
+        return [self.rows[row_id] for row_id in self.groups[field].get(normalize(value), ())]
+
+with boot_profiler.phase("pharmacy_index"):
+    pharmacy_index = PharmacyIndex(pharmacies)
+
+def extract_city_from_query(user_msg):
+    """Advanced city extraction from voice queries"""
+    user_msg_norm = normalized_text(user_msg)
     
     # Direct city matching
-    for city_norm, city_orig in cities_map.items():
-        if city_norm and city_norm in user_msg_norm:
-            found_cities.append(city_orig)
+    found_cities = city_recognizer.find(user_msg_norm)
     
     # If no cities found, try major Italian cities patterns
     major_cities_patterns = {
@@ -1515,7 +2803,7 @@ def extract_city_from_query(user_msg):
         for pattern, city in major_cities_patterns.items():
             if re.search(pattern, user_msg_norm, re.IGNORECASE):
                 # Check if this city exists in our CSV
-                if city in cities_original:
+                if city in city_recognizer.cities:
                     found_cities.append(city)
                     break
     
@@ -1523,16 +2811,7 @@ def extract_city_from_query(user_msg):
 
 def get_available_cities_sample():
     """Get a sample of available cities for user guidance"""
-    city_keys = ['Città', 'città', 'city', 'City', 'CITTÀ']
-    cities_set = set()
-    
-    for ph in pharmacies:
-        for key in city_keys:
-            city = ph.get(key, "")
-            if city and city.strip():
-                cities_set.add(city.strip())
-    
-    cities_list = sorted(list(cities_set))
+    cities_list = pharmacy_index.cities
     
     # Return first 10 cities as examples
     if len(cities_list) > 10:
@@ -1543,6 +2822,8 @@ def get_available_cities_sample():
 
 def extract_field_intent(user_msg):
     """Extract what information user wants about pharmacy"""
+    if isinstance(user_msg, MessageAnalysis):
+        user_msg = user_msg.corrected
     user_msg = user_msg.lower()
     intents = []
     
@@ -1566,45 +2847,29 @@ def extract_field_intent(user_msg):
 
 def pharmacy_best_match(user_msg, city=None):
     """Find best matching pharmacy"""
-    user_msg_norm = normalize(user_msg)
-    max_score = 0
-    best_ph = None
-    
-    for ph in pharmacies:
-        name = normalize(ph.get("Farmacia", ph.get("Nome", "")))
-        city_ph = normalize(ph.get("Città", ph.get("città", "")))
-        prov = normalize(ph.get("Provincia", ph.get("provincia", "")))
-        cap = normalize(ph.get("CAP", ph.get("cap", "")))
-        reg = normalize(ph.get("Regione", ph.get("regione", "")))
-        
-        if city and city_ph != normalize(city):
-            continue
-        
-        score = 0
-        if name and name in user_msg_norm:
-            score += 4
-        if city_ph and city_ph in user_msg_norm:
-            score += 3
-        if prov and prov in user_msg_norm:
-            score += 2
-        if cap and cap in user_msg_norm:
-            score += 2
-        if reg and reg in user_msg_norm:
-            score += 1
-        
-        if score > max_score:
-            max_score = score
-            best_ph = ph
-    
-    return best_ph
+    user_msg_norm = normalized_text(user_msg)
+    scores = Counter()
+    
+    # Column values contained in the message, found in one pass; each scores all the rows having it
+    found = {value for _, _, value in pharmacy_index.values.matches(user_msg_norm)}
+    for column, weight in PHARMACY_MATCH_WEIGHTS:
+        groups = pharmacy_index.groups[column]
+        for value in found:
+            for row_id in groups.get(value, ()):
+                scores[row_id] += weight
+    
+    if city:
+        in_city = pharmacy_index.groups["city"].get(normalize(city), ())
+        scores = Counter({row_id: scores[row_id] for row_id in in_city if row_id in scores})
+    if not scores:
+        return None
+    # Highest score, first row of the table among equals
+    best_id = min(scores, key=lambda row_id: (-scores[row_id], row_id))
+    return pharmacies[best_id]
 
 def pharmacies_by_city(city_name):
     """Get all pharmacies in a specific city"""
-    city_norm = normalize(city_name)
-    return [
-        ph for ph in pharmacies
-        if normalize(ph.get("Città", ph.get("città", ""))) == city_norm
-    ]
+    return pharmacy_index.lookup("city", city_name)
 
 def format_pharmacies_list(ph_list, city_name, user_msg=None):
     """Professional voice-optimized pharmacy list response with formal Italian"""
@@ -1709,9 +2974,11 @@ def format_pharmacy_answer(ph, field_intents):
     
     return "\n".join(lines)
 
+EARTH_RADIUS_KM = 6371.0
+
 def haversine(lat1, lon1, lat2, lon2):
     """Calculate distance between two points"""
-    R = 6371.0
+    R = EARTH_RADIUS_KM
     phi1 = math.radians(float(lat1))
     phi2 = math.radians(float(lat2))
     dphi = math.radians(float(lat2) - float(lat1))
@@ -1719,31 +2986,151 @@ def haversine(lat1, lon1, lat2, lon2):
     a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
     return R * 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
 
+class PharmacyLocator:
+    """Pharmacy coordinates for nearest, k-nearest and radius queries: a haversine BallTree once built, else one vectorized scan"""
+    def __init__(self, rows):
+        self.row_ids = []
+        self.points = []
+        for row_id, ph in enumerate(rows):
+            lat = ph.get('lat') or ph.get('Latitudine')
+            lon = ph.get('lon') or ph.get('Longitudine')
+            if not lat or not lon:
+                continue
+            try:
+                self.points.append((float(lat), float(lon)))
+            except ValueError:
+                continue
+            self.row_ids.append(row_id)
+        if numpy_available:
+            radians = np.radians(np.array(self.points, dtype=float).reshape(-1, 2))
+            self.lats, self.lons = radians[:, 0], radians[:, 1]
+        self.tree = None
+
+    def build_tree(self):
+        from sklearn.neighbors import BallTree
+        if self.points:
+            self.tree = BallTree(np.radians(self.points), metric="haversine")
+
+    def nearest(self, lat, lon, k=1):
+        """(row id, distance in km) of the k pharmacies closest to (lat, lon), closest first"""
+        k = min(k, len(self.points))
+        if k <= 0:
+            return []
+        tree = self.tree
+        if tree is not None:
+            distances, indexes = tree.query(np.radians([[lat, lon]]), k=k)
+            return [(self.row_ids[i], EARTH_RADIUS_KM * float(d)) for i, d in zip(indexes[0], distances[0])]
+        if numpy_available:
+            distances = self.distances(lat, lon)
+            closest = np.argsort(distances, kind="stable")[:k]
+            return [(self.row_ids[i], float(distances[i])) for i in closest]
+        return heapq.nsmallest(k, (
+            (row_id, haversine(lat, lon, p_lat, p_lon)) for row_id, (p_lat, p_lon) in zip(self.row_ids, self.points)
+        ), key=lambda item: item[1])
+
+    def within(self, lat, lon, radius_km):
+        """(row id, distance in km) of every pharmacy within radius_km of (lat, lon), closest first"""
+        if not self.points:
+            return []
+        tree = self.tree
+        if tree is not None:
+            indexes, distances = tree.query_radius(
+                np.radians([[lat, lon]]), r=radius_km / EARTH_RADIUS_KM, return_distance=True, sort_results=True
+            )
+            return [(self.row_ids[i], EARTH_RADIUS_KM * float(d)) for i, d in zip(indexes[0], distances[0])]
+        if numpy_available:
+            distances = self.distances(lat, lon)
+            inside = np.flatnonzero(distances <= radius_km)
+            inside = inside[np.argsort(distances[inside], kind="stable")]
+            return [(self.row_ids[i], float(distances[i])) for i in inside]
+        found = (
+            (row_id, haversine(lat, lon, p_lat, p_lon)) for row_id, (p_lat, p_lon) in zip(self.row_ids, self.points)
+        )
+        return sorted((item for item in found if item[1] <= radius_km), key=lambda item: item[1])
+
+    def distances(self, lat, lon):
+        """Haversine distance in km from (lat, lon) to every point, as a numpy array"""
+        lat, lon = math.radians(lat), math.radians(lon)
+        a = np.sin((self.lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(self.lats) * np.sin((self.lons - lon) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+with boot_profiler.phase("pharmacy_locator"):
+    pharmacy_locator = PharmacyLocator(pharmacies)
+
+# How many pharmacies the "vicino a me" replies list
+NEAR_ME_RESULTS = int(os.environ.get("NEAR_ME_RESULTS", 3))
+
+def nearest_pharmacies(user_lat, user_lon, k=NEAR_ME_RESULTS):
+    """The k pharmacies closest to the user, closest first, each a copy with its 'distanza_km'"""
+    found = []
+    for row_id, dist in pharmacy_locator.nearest(float(user_lat), float(user_lon), k):
+        ph = pharmacies[row_id].copy()
+        ph['distanza_km'] = round(dist, 2)
+        found.append(ph)
+    return found
+
 def nearest_pharmacy(user_lat, user_lon):
     """Find nearest pharmacy"""
-    min_dist = float('inf')
-    best_ph = None
-    
-    for ph in pharmacies:
-        lat = ph.get('lat') or ph.get('Latitudine')
-        lon = ph.get('lon') or ph.get('Longitudine')
-        
-        if not lat or not lon:
-            continue
-            
-        try:
-            dist = haversine(user_lat, user_lon, float(lat), float(lon))
-            if dist < min_dist:
-                min_dist = dist
-                best_ph = ph.copy()
-                best_ph['distanza_km'] = round(dist, 2)
-        except Exception:
-            continue
-    
-    return best_ph
-
-def format_nearest_pharmacy(ph):
-    """Format nearest pharmacy response"""
+    found = nearest_pharmacies(user_lat, user_lon, k=1)
+    return found[0] if found else None
+
+def pharmacies_within(user_lat, user_lon, radius_km, limit=None):
+    """How many pharmacies are within radius_km of the user, and the closest `limit` of them with their 'distanza_km'"""
+    found = pharmacy_locator.within(float(user_lat), float(user_lon), float(radius_km))
+    closest = []
+    for row_id, dist in found[:limit]:
+        ph = pharmacies[row_id].copy()
+        ph['distanza_km'] = round(dist, 2)
+        closest.append(ph)
+    return len(found), closest
+
+# "farmacie entro 5 km", "nel raggio di 10 chilometri", "a meno di 2,5 km"
+RADIUS_RE = re.compile(
+    r"\b(?:entro|raggio(?:\s+di)?|a\s+meno\s+di|nel\s+giro\s+di|within)\s+(\d+(?:[.,]\d+)?)\s*"
+    r"(?:km|chilometr[oi]|kilometr[oi]|kilometers?)\b"
+)
+# Largest radius searched for chat messages (larger ones are clamped) and accepted by /pharmacies/near
+NEAR_MAX_RADIUS_KM = float(os.environ.get("NEAR_MAX_RADIUS_KM", 200))
+# How many pharmacies a radius reply lists
+NEAR_RADIUS_RESULTS = int(os.environ.get("NEAR_RADIUS_RESULTS", 5))
+
+def extract_radius_km(user_msg):
+    """Radius in km asked for in the message ("entro 5 km"), or None"""
+    text = user_msg.text if isinstance(user_msg, MessageAnalysis) else str(user_msg or "")
+    m = RADIUS_RE.search(text.lower())
+    if not m:
+        return None
+    radius = float(m.group(1).replace(",", "."))
+    return radius if radius > 0 else None
+
+def format_pharmacies_within(total, closest, radius_km, asked_km=None):
+    """Reply listing the pharmacies found within a radius, closest first (asked_km: the larger radius asked for)"""
+    radius = f"{radius_km:g}"
+    clamped = ""
+    if asked_km is not None and asked_km > radius_km:
+        clamped = f"Posso cercare al massimo entro {radius} km, quindi ho limitato la ricerca a questo raggio. "
+    if not closest:
+        return clamped + (
+            f"Non ho trovato farmacie Otofarma entro {radius} km dalla tua posizione. "
+            f"Prova ad allargare il raggio oppure chiedimi la farmacia più vicina a te."
+        )
+    if total == 1:
+        intro = f"Ho trovato una farmacia Otofarma entro {radius} km da te:"
+    elif total > len(closest):
+        intro = f"Ho trovato {total} farmacie Otofarma entro {radius} km da te. Ecco le più vicine:"
+    else:
+        intro = f"Ho trovato {total} farmacie Otofarma entro {radius} km da te:"
+    intro = clamped + intro
+    lines = [
+        f"- {ph.get('Nome') or ph.get('Farmacia') or 'Nome non disponibile'}, "
+        f"{ph.get('indirizzo') or ph.get('Indirizzo') or ''}, {ph.get('città') or ph.get('Città') or ''} "
+        f"({ph['distanza_km']} km), tel. {ph.get('telefono') or ph.get('Telefono') or 'non disponibile'}"
+        for ph in closest
+    ]
+    return "\n".join([intro] + lines + ["Se ti serve altro chiedimi pure, sono qui per aiutarti!"])
+
+def format_nearest_pharmacy(ph, others=()):
+    """Format nearest pharmacy response, followed by a short line for each of the other nearby pharmacies"""
     if not ph:
         return random.choice([
             "Non sono riuscito a localizzare una farmacia nelle immediate vicinanze. Riprova tra qualche minuto oppure controlla la connessione.",
@@ -1772,6 +3159,14 @@ def format_nearest_pharmacy(ph):
         f"Email: {email}",
         f"Distanza stimata: {distanza} km"
     ]
+    if others:
+        dettagli.append("Altre farmacie vicine:")
+        for other in others:
+            dettagli.append(
+                f"- {other.get('Nome') or other.get('Farmacia') or 'Nome non disponibile'}, "
+                f"{other.get('indirizzo') or other.get('Indirizzo') or ''}, {other.get('città') or other.get('Città') or ''} "
+                f"({other.get('distanza_km', '?')} km)"
+            )
     
     outro = "Se ti serve altro chiedimi pure, sono qui per aiutarti!"
     
@@ -1779,7 +3174,7 @@ def format_nearest_pharmacy(ph):
 
 def is_near_me_query(user_msg):
     """Detect 'near me' queries"""
-    msg = normalize(user_msg)
+    msg = normalized_text(user_msg, corrected=False)
     near_patterns = [
         "pharmacy near me", "pharmacies near me", "nearest pharmacy",
         "farmacia più vicina", "farmacia vicina", "farmacia vicino a me", 
@@ -1849,21 +3244,33 @@ def initialize_gemini():
     """Initialize Gemini AI"""
     try:
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "speakai-467308-fb5a36feacef.json"
+        import vertexai
         vertexai.init(project="speakai-467308", location="us-east4") # Changed location
         return True
     except Exception as e:
         print(f"Gemini initialization error: {e}")
         return False
 
-# Initialize Gemini
-gemini_available = initialize_gemini()
+# Gemini is initialized on first use or by the warm-up thread (None until then):
+# vertexai takes seconds to import
+gemini_available = None
+GEMINI_LOCK = threading.Lock()
+
+def gemini_ready():
+    """Initialize Gemini if nobody has yet; True when it is available"""
+    global gemini_available
+    with GEMINI_LOCK:
+        if gemini_available is None:
+            gemini_available = initialize_gemini()
+        return gemini_available
 
 def get_gemini_conversation(user_message):
     """Get natural conversation from Gemini - ALWAYS ITALIAN - ALWAYS OTOFARMA"""
-    if not gemini_available:
+    if not gemini_ready():
         return None
         
     try:
+        from vertexai.generative_models import GenerativeModel
         model = GenerativeModel("gemini-2.0-flash-001")  # Latest available model
         
         prompt = f"""
@@ -1971,7 +3378,7 @@ def get_gemini_conversation(user_message):
 
 def should_use_gemini_for_conversation(user_message):
     """Decide if message should use Gemini for natural conversation - EXCLUDES CREATOR QUESTIONS"""
-    user_msg = normalize(user_message.strip())
+    user_msg = normalized_text(user_message, corrected=False)
     
     # NEVER use Gemini for creator questions - these have dedicated corporate responses
     creator_indicators = [
@@ -2008,51 +3415,51 @@ def should_use_gemini_for_conversation(user_message):
 
 def process_voice_through_existing_chat(transcribed_text):
     """Process voice input through existing chat logic"""
-    # Use all your existing chat processing logic
-    user_message_corr = correct_spelling(transcribed_text)
+    # Use all your existing chat processing logic, preprocessing the text once
+    analysis = MessageAnalysis(transcribed_text)
     
     # Assistant name detection
-    if detect_assistant_name(user_message_corr):
+    if detect_assistant_name(analysis):
         return get_assistant_introduction()
     
     # General patterns
-    general = check_general_patterns(user_message_corr)
+    general = check_general_patterns(analysis)
     if general:
         return general
     
     # Language detection
-    if not is_probably_italian(user_message_corr):
+    if not is_probably_italian(analysis):
         return "Questo assistente risponde solo a domande in italiano."
     
     # Office hours
-    if detect_office_hours_question(user_message_corr):
+    if detect_office_hours_question(analysis):
         return get_office_hours_answer()
     
     # Time/date
-    time_or_date = detect_time_or_date_question(user_message_corr)
+    time_or_date = detect_time_or_date_question(analysis)
     if time_or_date == "time":
         return get_time_answer()
     elif time_or_date == "date":
         return get_date_answer()
     
     # YAML matching
-    reply = match_yaml_qa_ai(user_message_corr)
+    reply = match_yaml_qa_ai(analysis)
     if reply:
         return reply
     
     # Pharmacy queries
-    if is_pharmacy_question(user_message_corr):
-        found_cities = extract_city_from_query(user_message_corr)
+    if is_pharmacy_question(analysis):
+        found_cities = extract_city_from_query(analysis)
         if found_cities:
             city = found_cities[0]
             ph_list = pharmacies_by_city(city)
             if ph_list:
-                return format_pharmacies_list(ph_list, city, user_message_corr)
+                return format_pharmacies_list(ph_list, city, analysis.corrected)
             else:
                 return "Non ho trovato farmacie Otofarma in questa città."
         else:
-            field_intents = extract_field_intent(user_message_corr)
-            best_ph = pharmacy_best_match(user_message_corr)
+            field_intents = extract_field_intent(analysis)
+            best_ph = pharmacy_best_match(analysis)
             return format_pharmacy_answer(best_ph, field_intents)
     
     # Fallback
@@ -2070,8 +3477,11 @@ def index():
 def voice_activation():
     """Endpoint specifically for voice activation detection"""
     user_message = request.json.get("message", "")
+    if not wait_for_corpus():
+        return warming_up()
     
-    if detect_precise_assistant_name(user_message):
+    analysis = MessageAnalysis(user_message)
+    if detect_precise_assistant_name(analysis):
         return jsonify({
             "activated": True,
             "reply": get_assistant_introduction(),
@@ -2079,8 +3489,7 @@ def voice_activation():
             "intent": "greeting"
         })
     # Pharmacy intent detection
-    user_message_corr = correct_spelling(user_message)
-    if is_pharmacy_question(user_message_corr):
+    if is_pharmacy_question(analysis):
         return jsonify({
             "activated": True,
             "reply": "Ecco le informazioni sulle farmacie Otofarma. Dimmi la città che ti interessa!",
@@ -2089,24 +3498,107 @@ def voice_activation():
         })
     return jsonify({"activated": False})
 
-@app.route("/chat", methods=["POST"])
-def chat():
-    """Main chat endpoint with advanced appointment booking priority"""
-    user_message = request.json.get("message", "")
-    voice_mode = request.json.get("voice", True)
-    user_lat = request.json.get("lat", None)
-    user_lon = request.json.get("lon", None)
+# Appointment phrases checked by chat() before any other routing
+APPOINTMENT_CHECK_KEYWORDS = [
+    "ho appuntamento", "il mio appuntamento", "la mia prenotazione", "quando è il mio appuntamento",
+    "ho una prenotazione", "controlla appuntamento", "verifica appuntamento", "ho prenotato",
+    "sono prenotato", "sono registrato", "sono in lista", "mio appuntamento", "mia prenotazione",
+    "ho già prenotato", "ho già appuntamento", "sono in agenda"
+]
+APPOINTMENT_KEYWORDS = [
+    "prenota", "prenotare", "appuntamento", "visita", "richiedo", "richiedere", "voglio", "vorrei", "prenotazione"
+]
 
-    print(f"Received message: '{user_message}'")
-    check_keywords = [
-        "ho appuntamento", "il mio appuntamento", "la mia prenotazione", "quando è il mio appuntamento",
-        "ho una prenotazione", "controlla appuntamento", "verifica appuntamento", "ho prenotato",
-        "sono prenotato", "sono registrato", "sono in lista", "mio appuntamento", "mia prenotazione",
-        "ho già prenotato", "ho già appuntamento", "sono in agenda"
-    ]
+def corporate_reply(corporate_topic):
+    """Corporate knowledge answer for a topic from detect_corporate_question"""
+    handlers = {
+        "headquarters": get_headquarters_info,
+        "founder": get_founder_info,
+        "ceo": get_ceo_info,
+        "leadership": get_leadership_info,
+        "it_head": get_it_head_info,
+        "frontend_dev": get_frontend_developer_info,
+        "technical_team": get_technical_team_info,
+        "creator": get_creator_info,
+        "architecture": get_architecture_info
+    }
+    return handlers.get(corporate_topic, get_headquarters_info)()  # Headquarters as default fallback
+
+def pharmacy_reply(analysis):
+    """Answer to a pharmacy question: the pharmacies of the city asked for, or a prompt for the city"""
+    user_message_corr = analysis.corrected
+    print(f"🏥 Pharmacy question detected: {user_message_corr}")
+    found_cities = extract_city_from_query(analysis)
+    if found_cities:
+        city = found_cities[0]
+        print(f"🏙️ City found: {city}")
+        ph_list = pharmacies_by_city(city)
+        if ph_list:
+            reply = format_pharmacies_list(ph_list, city, user_message_corr)
+            print(f"✅ Found {len(ph_list)} pharmacies in {city}")
+        else:
+            reply = (
+                f"Mi dispiace, non ho trovato farmacie Otofarma specificamente a {city}. "
+                f"Tuttavia, Otofarma ha una vasta rete di farmacie affiliate in tutta Italia. "
+                f"Ti consiglio di provare a cercare nelle città limitrofe o contattare "
+                f"direttamente il servizio clienti Otofarma per informazioni su farmacie "
+                f"nella tua zona. Posso aiutarti con altre città o servizi Otofarma?"
+            )
+            print(f"❌ No pharmacies found in {city}")
+    else:
+        city_examples = get_available_cities_sample()
+        reply = (
+            "Per aiutarti a trovare una farmacia Otofarma, potresti specificare la città "
+            "che ti interessa? Ad esempio, puoi dire 'dove sono le farmacie Otofarma a Milano' "
+            "oppure 'farmacie Otofarma a Roma'. " + city_examples + " "
+            "Sono qui per fornirti tutte le informazioni sui nostri punti vendita "
+            "specializzati in apparecchi acustici e servizi audiologici."
+        )
+        print("🤔 No city detected in pharmacy query")
+    return reply
+
+def fallback_reply(analysis):
+    """Professional fallback reply, mentioning the first meaningful keyword of the message"""
+    user_kw = ""
+    user_words = re.findall(r'\w+', analysis.normalized)
+    for w in user_words:
+        if w not in {"ciao", "salve", "buongiorno", "buonasera", "buonanotte", "come", "va", "stai", "sei", "sono", "grazie", "bot", "otobot", "otofarma", "assistente"} and len(w) > 3:
+            user_kw = w
+            break
+
+    if user_kw:
+        fallback_messages = [
+            f"Mi dispiace, non ho ancora conoscenze specifiche su '{user_kw}'. Ti consiglio di contattare direttamente il nostro team di esperti Otofarma o riformulare la domanda. Posso comunque aiutarti con altri argomenti!",
+            
+            f"Non dispongo di informazioni dettagliate su '{user_kw}' al momento, ma posso aiutarti con apparecchi acustici, servizi audiologici, farmacie e molto altro ancora!",
+            
+            f"Al momento non ho dati specifici su '{user_kw}', ma posso assisterti con informazioni su prodotti Otofarma, servizi di consulenza audiologica, o localizzazione delle nostre farmacie.",
+            
+            f"Non ho una risposta precisa su '{user_kw}', ma il nostro team di specialisti Otofarma sarà felice di aiutarti. Nel frattempo, posso assisterti con altri argomenti!",
+            
+            f"Mi scuso, non ho trovato dettagli su '{user_kw}'. Tuttavia, posso aiutarti con apparecchi acustici, servizi audiologici, e tutto ciò che riguarda il mondo Otofarma!"
+        ]
+    else:
+        fallback_messages = [
+            "Al momento non dispongo di una risposta precisa alla tua richiesta, ma sono qui per aiutarti su qualsiasi altro tema riguardante Otofarma.",
+            "Mi scuso, non sono riuscito a trovare una risposta soddisfacente. Se desideri, puoi riformulare la domanda o chiedere su un altro argomento.",
+            "Domanda interessante! Tuttavia, non ho informazioni puntuali su questo punto. Sono a disposizione per altre domande.",
+            "La tua richiesta è stata ricevuta, ma non dispongo di dettagli specifici. Puoi fornire ulteriori informazioni o chiedere altro?",
+            "Non trovo una risposta adeguata in questo momento. Ti invito a riformulare o a chiedere su altri temi.",
+            "Mi dispiace, non ho trovato la risposta richiesta. Se vuoi puoi essere più dettagliato oppure chiedere su altri servizi Otofarma.",
+            "Se hai bisogno di informazioni su servizi, apparecchi acustici o farmacie, chiedimi pure senza esitare.",
+            "Sono qui per offrirti il massimo supporto: puoi essere più specifico nella tua richiesta?"
+        ]
+    return fallback_mem.get_unique(fallback_messages)
+
+def route_message(user_message, user_lat=None, user_lon=None, live=True):
+    """Route a message as chat() answers it: (route, strategy, score, reply); live=False books nothing and skips Gemini"""
+    # Spelling correction, normalization and keywords are computed once per message
+    analysis = analyze_message(user_message)
   
-    if any(kw in normalize(user_message) for kw in check_keywords):
+    if any(kw in analysis.raw_normalized for kw in APPOINTMENT_CHECK_KEYWORDS):
         info = extract_appointment_info_smart(user_message)
+        found = None
          # Privacy: require both name and phone
         if info.get("name") and info.get("phone"):
           found = find_appointment(name=info.get("name"), phone=info.get("phone"))
@@ -2122,13 +3614,10 @@ def chat():
                 "Non trovo una prenotazione a tuo nome o numero. "
                 "Se pensi di aver prenotato, controlla di aver fornito nome e telefono corretti."
             )
-        return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True})
+        return "appointment_check", None, None, reply
 
     # 1. Appointment booking logic FIRST (before Gemini, before everything)
-    appointment_keywords = [
-        "prenota", "prenotare", "appuntamento", "visita", "richiedo", "richiedere", "voglio", "vorrei", "prenotazione"
-    ]
-    if any(kw in normalize(user_message) for kw in appointment_keywords):
+    if any(kw in analysis.raw_normalized for kw in APPOINTMENT_KEYWORDS):
         info = extract_appointment_info_smart(user_message)
         missing = []
         if not info.get("name"):
@@ -2144,204 +3633,273 @@ def chat():
                 + ". Puoi fornirmeli?"
             )
             print("Appointment booking: missing info", missing)
-            return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True})
+            return "appointment", None, None, reply
         
-        send_appointment_email(info["name"], info["phone"], info["date"])
-        save_appointment_to_db(info["name"], info["phone"], info["date"])
+        if live:
+            send_appointment_email(info["name"], info["phone"], info["date"])
+            save_appointment_to_db(info["name"], info["phone"], info["date"])
+            print("Appointment booking: email sent", info)
         reply = (
             f"Ciao {info['name']},\n"
             f"Ho inviato la tua richiesta di appuntamento per il giorno {info['date']} al nostro team Otofarma.\n"
             f"Riceverai presto una chiamata di conferma al numero {info['phone']}.\n"
             "Grazie per aver scelto Otofarma! Se hai altre esigenze, sono sempre qui per aiutarti in modo professionale e cordiale."
         )
-        print("Appointment booking: email sent", info)
-        return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True})
+        return "appointment", None, None, reply
         # 1. Check for assistant name activation
-    if detect_assistant_name(user_message):
-        return jsonify({
-            "reply": handle_voice_activation_greeting(),
-            "voice": voice_mode,
-            "male_voice": True,
-            "intent": "greeting"
-        })
+    if detect_assistant_name(analysis):
+        return "assistant_name", None, None, handle_voice_activation_greeting()
 
     # 2. Enhanced conversation handling with Gemini
-    if should_use_gemini_for_conversation(user_message):
+    if live and should_use_gemini_for_conversation(analysis):
         gemini_reply = get_gemini_conversation(user_message)
         if gemini_reply:
             print(f"Gemini conversation response generated")
-            return jsonify({"reply": gemini_reply, "voice": voice_mode, "male_voice": True})
+            return "gemini", None, None, gemini_reply
 
     # 2b. Fallback to existing general patterns
-    general = check_general_patterns(user_message)
+    general = check_general_patterns(analysis)
     if general:
-        return jsonify({"reply": general, "voice": voice_mode, "male_voice": True})
+        return "general", None, None, general
 
-    # 3. Handle location-based queries
-    if is_near_me_query(user_message):
+    # 3. Handle location-based queries ("vicino a me", "entro 5 km")
+    radius_km = extract_radius_km(analysis)
+    if radius_km is not None or is_near_me_query(analysis):
         if user_lat is not None and user_lon is not None:
             try:
-                best_ph = nearest_pharmacy(float(user_lat), float(user_lon))
-                reply = format_nearest_pharmacy(best_ph)
+                if radius_km is not None:
+                    searched_km = min(radius_km, NEAR_MAX_RADIUS_KM)
+                    total, closest = pharmacies_within(float(user_lat), float(user_lon), searched_km, NEAR_RADIUS_RESULTS)
+                    reply = format_pharmacies_within(total, closest, searched_km, asked_km=radius_km)
+                else:
+                    nearby = nearest_pharmacies(float(user_lat), float(user_lon))
+                    reply = format_nearest_pharmacy(nearby[0] if nearby else None, nearby[1:])
             except Exception:
                 reply = "Si è verificato un errore nel calcolo della farmacia più vicina. Riprova tra poco!"
         else:
             reply = "Per poterti suggerire la farmacia più vicina ho bisogno che il browser consenta l'accesso alla posizione: controlla le impostazioni e aggiorna la pagina."
-        return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True})
+        return "near_me", None, None, reply
 
     # 4. Spell correction and language detection
-    user_message_corr = correct_spelling(user_message)
-    if not is_probably_italian(user_message_corr):
-        return jsonify({"reply": "Questo assistente risponde solo a domande in italiano. Per favore riformula la domanda in italiano.", "voice": voice_mode, "male_voice": True})
+    user_message_corr = analysis.corrected
+    if not is_probably_italian(analysis):
+        return "not_italian", None, None, "Questo assistente risponde solo a domande in italiano. Per favore riformula la domanda in italiano."
 
     print(f"After spell correction: '{user_message_corr}'")
-        # --- Advanced Appointment Booking Logic ---
-    # ...inside def chat(): after user_message_corr is defined...
-
-    # --- Advanced Appointment Booking Logic ---
-   
 
     # 5. Check for office hours (before YAML to avoid conflicts)
-    if detect_office_hours_question(user_message_corr):
-        return jsonify({"reply": get_office_hours_answer(), "voice": voice_mode, "male_voice": True})
+    if detect_office_hours_question(analysis):
+        return "office_hours", None, None, get_office_hours_answer()
 
     # 6. Check for time/date questions (with strict matching)
-    time_or_date = detect_time_or_date_question(user_message_corr)
+    time_or_date = detect_time_or_date_question(analysis)
     if time_or_date == "time":
-        return jsonify({"reply": get_time_answer(), "voice": voice_mode, "male_voice": True})
+        return "time", None, None, get_time_answer()
     elif time_or_date == "date":
-        return jsonify({"reply": get_date_answer(), "voice": voice_mode, "male_voice": True})
+        return "date", None, None, get_date_answer()
 
     # 6.5. Enhanced Corporate Knowledge (Complete Team & Leadership)
-    corporate_topic = detect_corporate_question(user_message_corr)
+    corporate_topic = detect_corporate_question(analysis)
     if corporate_topic:
         print(f"🏢 Corporate question detected: {corporate_topic}")
-        if corporate_topic == "headquarters":
-            reply = get_headquarters_info()
-        elif corporate_topic == "founder":
-            reply = get_founder_info()
-        elif corporate_topic == "ceo":
-            reply = get_ceo_info()
-        elif corporate_topic == "leadership":
-            reply = get_leadership_info()
-        elif corporate_topic == "it_head":
-            reply = get_it_head_info()
-        elif corporate_topic == "frontend_dev":
-            reply = get_frontend_developer_info()
-        elif corporate_topic == "technical_team":
-            reply = get_technical_team_info()
-        elif corporate_topic == "creator":
-            reply = get_creator_info()
-        elif corporate_topic == "architecture":
-            reply = get_architecture_info()
-        else:
-            reply = get_headquarters_info()  # Default fallback
+        reply = corporate_reply(corporate_topic)
         
         print(f"✅ Corporate info provided: {corporate_topic}")
-        return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True})
+        return "corporate", corporate_topic, None, reply
 
     # 7. YAML Q&A matching (highest priority for content)
-    reply = match_yaml_qa_ai(user_message_corr)
+    reply, strategy, score = match_yaml_qa_scored(analysis)
     if reply:
         print(f"Found YAML answer: {reply[:100]}...")
+        return "yaml", strategy, float(score), reply
+
+    # 8. Enhanced Pharmacy-specific queries for Voice Assistant
+    if is_pharmacy_question(analysis):
+        return "pharmacy", None, None, pharmacy_reply(analysis)
+
+        # 8.5. Gemini AI fallback for questions not covered by YAML or app logic
+    if live:
+        print("Trying Gemini fallback...")
+        if gemini_ready():
+            gemini_reply = get_gemini_conversation(user_message_corr)
+            if gemini_reply:
+                print(f"Gemini fallback response generated: {gemini_reply[:50]}...")
+                return "gemini", None, None, gemini_reply
+            else:
+                print("Gemini returned empty response")
+        else:
+            print("Gemini not available - check initialization")
+
+    # 9. Fallback responses
+    return "fallback", None, None, fallback_reply(analysis)
+
+# Intent reported to the page for the routes that have one
+ROUTE_INTENTS = {"assistant_name": "greeting", "pharmacy": "pharmacy"}
+
+@app.route("/chat", methods=["POST"])
+def chat():
+    """Main chat endpoint with advanced appointment booking priority"""
+    user_message = request.json.get("message", "")
+    voice_mode = request.json.get("voice", True)
+    user_lat = request.json.get("lat", None)
+    user_lon = request.json.get("lon", None)
+
+    print(f"Received message: '{user_message}'")
+    if not wait_for_corpus():
+        return warming_up()
+
+    route, strategy, score, reply = route_message(user_message, user_lat, user_lon)
+    g.route = (route, strategy, score)  # read back by golden_report.py
+    if route == "yaml":
         # Start background generation of TTS audio for KB replies so /tts can serve it quickly
         try:
             t = threading.Thread(target=cache_tts_background, args=(reply,), daemon=True)
             t.start()
         except Exception as e:
             logger.warning(f"Failed to start background TTS cache thread: {e}")
-        return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True})
 
-    # 8. Enhanced Pharmacy-specific queries for Voice Assistant
-    if is_pharmacy_question(user_message_corr):
-        print(f"🏥 Pharmacy question detected: {user_message_corr}")
-        found_cities = extract_city_from_query(user_message_corr)
-        if found_cities:
-            city = found_cities[0]
-            print(f"🏙️ City found: {city}")
-            ph_list = pharmacies_by_city(city)
-            if ph_list:
-                reply = format_pharmacies_list(ph_list, city, user_message_corr)
-                print(f"✅ Found {len(ph_list)} pharmacies in {city}")
-            else:
-                reply = (
-                    f"Mi dispiace, non ho trovato farmacie Otofarma specificamente a {city}. "
-                    f"Tuttavia, Otofarma ha una vasta rete di farmacie affiliate in tutta Italia. "
-                    f"Ti consiglio di provare a cercare nelle città limitrofe o contattare "
-                    f"direttamente il servizio clienti Otofarma per informazioni su farmacie "
-                    f"nella tua zona. Posso aiutarti con altre città o servizi Otofarma?"
-                )
-                print(f"❌ No pharmacies found in {city}")
-        else:
-            city_examples = get_available_cities_sample()
-            reply = (
-                "Per aiutarti a trovare una farmacia Otofarma, potresti specificare la città "
-                "che ti interessa? Ad esempio, puoi dire 'dove sono le farmacie Otofarma a Milano' "
-                "oppure 'farmacie Otofarma a Roma'. " + city_examples + " "
-                "Sono qui per fornirti tutte le informazioni sui nostri punti vendita "
-                "specializzati in apparecchi acustici e servizi audiologici."
-            )
-            print("🤔 No city detected in pharmacy query")
-        return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True, "intent": "pharmacy"})
+    response = {"reply": reply, "voice": voice_mode, "male_voice": True}
+    if route in ROUTE_INTENTS:
+        response["intent"] = ROUTE_INTENTS[route]
+    return jsonify(response)
+# ===== BATCH MATCHING =====
+# Worker processes for /match_batch and match_batch.py (1 runs the batch in-process)
+MATCH_BATCH_WORKERS = int(os.environ.get("MATCH_BATCH_WORKERS", os.cpu_count() or 1))
+MATCH_BATCH_MAX_MESSAGES = int(os.environ.get("MATCH_BATCH_MAX_MESSAGES", 1000))
+
+def timed_route(item):
+    """NDJSON record of route_message for one (index, message) pair"""
+    index, message = item
+    start = time.perf_counter()
+    route, strategy, score, reply = route_message(message, live=False)
+    return {
+        "index": index,
+        "message": message,
+        "route": route,
+        "strategy": strategy,
+        "score": score,
+        "reply": reply,
+        "gemini_eligible": should_use_gemini_for_conversation(message),
+        "latency_ms": round((time.perf_counter() - start) * 1000, 3)
+    }
 
-    # 9. Fallback responses
-        # 8.5. Gemini AI fallback for questions not covered by YAML or app logic
-    print("Trying Gemini fallback...")
-    if gemini_available:
-        gemini_reply = get_gemini_conversation(user_message_corr)
-        if gemini_reply:
-            print(f"Gemini fallback response generated: {gemini_reply[:50]}...")
-            return jsonify({"reply": gemini_reply, "voice": voice_mode, "male_voice": True})
+def batch_worker_init():
+    """Start a spawned worker only once it has loaded the corpus"""
+    wait_for_corpus(None)
+
+def batch_messages(items):
+    """Non-empty messages of a batch given as strings or {"message": ...} objects"""
+    messages = [item.get("message", "") if isinstance(item, dict) else item for item in items]
+    return [str(m).strip() for m in messages if m is not None and str(m).strip()]
+
+def parse_batch_messages(text):
+    """Messages of a batch file: a JSON array or one message per line"""
+    text = text.strip()
+    return batch_messages(json.loads(text) if text.startswith("[") else text.splitlines())
+
+BATCH_POOL = None
+BATCH_POOL_CORPUS = None  # corpus installed when the pool was started
+BATCH_POOL_LOCK = threading.Lock()
+
+def batch_pool():
+    """Process pool of MATCH_BATCH_WORKERS workers shared by every batch, started on first use"""
+    global BATCH_POOL, BATCH_POOL_CORPUS
+    with BATCH_POOL_LOCK:
+        if BATCH_POOL is not None and BATCH_POOL_CORPUS is not corpus_index:
+            # Workers don't watch the corpus: after a reload, batches go to
+            # a new pool and the old one exits once its batches are done
+            BATCH_POOL.shutdown(wait=False)
+            BATCH_POOL = None
+        if BATCH_POOL is None:
+            # Spawned workers import app afresh instead of inheriting locks that another thread may hold
+            BATCH_POOL = ProcessPoolExecutor(
+                max_workers=MATCH_BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=batch_worker_init
+            )
+            BATCH_POOL_CORPUS = corpus_index
+        return BATCH_POOL
+
+def match_batch(messages, workers=MATCH_BATCH_WORKERS):
+    """Yield the timed_route record of every message, in input order, as soon as it is ready (workers=1 routes in-process)"""
+    wait_for_corpus(None)
+    items = list(enumerate(messages))
+    if workers <= 1 or len(items) < 2:
+        for item in items:
+            yield timed_route(item)
+        return
+
+    chunksize = max(1, min(32, len(items) // (MATCH_BATCH_WORKERS * 4)))
+    yield from batch_pool().map(timed_route, items, chunksize=chunksize)
+
+@app.route("/match_stats", methods=["GET"])
+@admin_only
+def match_stats():
+    """YAML cascade statistics and spelling cache counters for tuning"""
+    return jsonify({
+        "cascade": cascade_stats.snapshot(),
+        "spelling_caches": spelling_cache_stats(),
+        "stem_cache": italian_stem.cache_info()._asdict(),
+        "pattern_rules": pattern_bank_stats()
+    })
+
+@app.route("/match_stats/reset", methods=["POST"])
+@admin_only
+def match_stats_reset():
+    """Clear the cascade statistics and the detector rule counters"""
+    cascade_stats.reset()
+    for bank in PATTERN_BANKS.values():
+        bank.reset()
+    return jsonify({"reset": True})
+
+@app.route("/boot_report", methods=["GET"])
+@admin_only
+def boot_report():
+    """Start-up timeline of this worker: phases with wall time and memory growth, readiness milestones"""
+    return jsonify(boot_profiler.report())
+
+@app.route("/match_batch", methods=["POST"])
+@admin_only
+def match_batch_endpoint():
+    """Stream one NDJSON record per message of a JSON array, {"messages": [...]} or a "file" (?workers=1: in-process)"""
+    try:
+        if "file" in request.files:
+            messages = parse_batch_messages(request.files["file"].read().decode("utf-8"))
         else:
-            print("Gemini returned empty response")
-    else:
-        print("Gemini not available - check initialization")
+            data = request.get_json(silent=True)
+            if isinstance(data, dict):
+                data = data.get("messages")
+            if not isinstance(data, list):
+                return jsonify({"error": "Expected a JSON array of messages, {\"messages\": [...]} or a file"}), 400
+            messages = batch_messages(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Invalid batch: {e}"}), 400
+
+    if len(messages) > MATCH_BATCH_MAX_MESSAGES:
+        return jsonify({"error": f"At most {MATCH_BATCH_MAX_MESSAGES} messages per batch"}), 413
+
+    if not wait_for_corpus():
+        return warming_up()
+    workers = min(request.args.get("workers", MATCH_BATCH_WORKERS, type=int), MATCH_BATCH_WORKERS)
+    logger.info(f"📦 Batch matching {len(messages)} messages {'in the shared pool' if workers > 1 else 'in-process'}")
+    records = (json.dumps(record, ensure_ascii=False) + "\n" for record in match_batch(messages, workers))
+    return Response(records, mimetype="application/x-ndjson")
+
+@app.route("/pharmacies/near", methods=["GET"])
+def pharmacies_near():
+    """Pharmacies within ?radius km (default 5) of ?lat/?lon, closest first, at most ?limit (default 20) of them"""
+    lat = request.args.get("lat", type=float)
+    lon = request.args.get("lon", type=float)
+    radius = request.args.get("radius", 5.0, type=float)
+    limit = request.args.get("limit", 20, type=int)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"error": "lat and lon are required (degrees)"}), 400
+    if not 0 < radius <= NEAR_MAX_RADIUS_KM:
+        return jsonify({"error": f"radius must be between 0 and {NEAR_MAX_RADIUS_KM:g} km"}), 400
+    if not 0 < limit <= 100:
+        return jsonify({"error": "limit must be between 1 and 100"}), 400
+
+    total, closest = pharmacies_within(lat, lon, radius, limit)
+    return jsonify({"lat": lat, "lon": lon, "radius_km": radius, "total": total, "pharmacies": closest})
 
-    fallback_messages = [
-        "Mi dispiace, sto avendo difficoltà a comprendere la tua richiesta. Potresti riformulare la domanda? Posso aiutarti con informazioni su Otofarma, apparecchi acustici, servizi audiologici e molto altro!",
-        
-        "Non sono riuscito a trovare una risposta soddisfacente. Se vuoi, puoi essere più specifico o chiedere su argomenti come apparecchi acustici, farmacie Otofarma, o servizi di consulenza.",
-        
-        "La tua richiesta è interessante, ma non dispongo di dettagli specifici al momento. Posso aiutarti con tutto ciò che riguarda Otofarma: prodotti, servizi, e assistenza audiologica!",
-        
-        "Al momento non trovo la risposta che cerchi. Ti invito a riformulare la domanda o a chiedere su temi come apparecchi acustici, prenotazione visite, o localizzazione farmacie.",
-        
-        "Posso offrirti il massimo supporto possibile! Puoi essere più dettagliato nella tua richiesta o chiedere informazioni su servizi Otofarma, prodotti audiologici, o farmacie?"
-    ]
-    
-        # Improved professional fallback with keyword mention
-    user_kw = ""
-    user_words = re.findall(r'\w+', normalize(user_message_corr))
-    for w in user_words:
-        if w not in {"ciao", "salve", "buongiorno", "buonasera", "buonanotte", "come", "va", "stai", "sei", "sono", "grazie", "bot", "otobot", "otofarma", "assistente"} and len(w) > 3:
-            user_kw = w
-            break
-
-    if user_kw:
-        fallback_messages = [
-            f"Mi dispiace, non ho ancora conoscenze specifiche su '{user_kw}'. Ti consiglio di contattare direttamente il nostro team di esperti Otofarma o riformulare la domanda. Posso comunque aiutarti con altri argomenti!",
-            
-            f"Non dispongo di informazioni dettagliate su '{user_kw}' al momento, ma posso aiutarti con apparecchi acustici, servizi audiologici, farmacie e molto altro ancora!",
-            
-            f"Al momento non ho dati specifici su '{user_kw}', ma posso assisterti con informazioni su prodotti Otofarma, servizi di consulenza audiologica, o localizzazione delle nostre farmacie.",
-            
-            f"Non ho una risposta precisa su '{user_kw}', ma il nostro team di specialisti Otofarma sarà felice di aiutarti. Nel frattempo, posso assisterti con altri argomenti!",
-            
-            f"Mi scuso, non ho trovato dettagli su '{user_kw}'. Tuttavia, posso aiutarti con apparecchi acustici, servizi audiologici, e tutto ciò che riguarda il mondo Otofarma!"
-        ]
-    else:
-        fallback_messages = [
-            "Al momento non dispongo di una risposta precisa alla tua richiesta, ma sono qui per aiutarti su qualsiasi altro tema riguardante Otofarma.",
-            "Mi scuso, non sono riuscito a trovare una risposta soddisfacente. Se desideri, puoi riformulare la domanda o chiedere su un altro argomento.",
-            "Domanda interessante! Tuttavia, non ho informazioni puntuali su questo punto. Sono a disposizione per altre domande.",
-            "La tua richiesta è stata ricevuta, ma non dispongo di dettagli specifici. Puoi fornire ulteriori informazioni o chiedere altro?",
-            "Non trovo una risposta adeguata in questo momento. Ti invito a riformulare o a chiedere su altri temi.",
-            "Mi dispiace, non ho trovato la risposta richiesta. Se vuoi puoi essere più dettagliato oppure chiedere su altri servizi Otofarma.",
-            "Se hai bisogno di informazioni su servizi, apparecchi acustici o farmacie, chiedimi pure senza esitare.",
-            "Sono qui per offrirti il massimo supporto: puoi essere più specifico nella tua richiesta?"
-        ]
-    reply = fallback_mem.get_unique(fallback_messages)
-    return jsonify({"reply": reply, "voice": voice_mode, "male_voice": True})
 # Google Cloud TTS endpoint for Italian male voice
 @app.route("/tts", methods=["POST"])
 def tts():
@@ -2355,7 +3913,7 @@ def tts():
     # 9. Fallback responses
     # 8.5. Gemini AI fallback for questions not covered by YAML or app logic
     print("Trying Gemini fallback...")
-    if gemini_available:
+    if gemini_ready():
         gemini_reply = get_gemini_conversation(user_message_corr)
         if gemini_reply:
             print(f"Gemini fallback response generated: {gemini_reply[:50]}...")
@@ -2409,14 +3967,12 @@ def transcribe():
     audio_bytes = audio_file.read()
 
     # use pooled SPEECH_CLIENT when available
-    if SPEECH_CLIENT:
-        client = SPEECH_CLIENT
-    else:
-        try:
-            client = speech.SpeechClient()
-        except Exception as e:
-            logger.error(f"Could not create SpeechClient: {e}")
-            return jsonify({"error": "Speech client init failed"}), 500
+    try:
+        from google.cloud import speech
+        client = get_speech_client()
+    except Exception as e:
+        logger.error(f"Could not create SpeechClient: {e}")
+        return jsonify({"error": "Speech client init failed"}), 500
     audio = speech.RecognitionAudio(content=audio_bytes)
     config = speech.RecognitionConfig(
         encoding=speech.RecognitionConfig.AudioEncoding.WEBM_OPUS,
@@ -2431,6 +3987,37 @@ def transcribe():
         transcript += result.alternatives[0].transcript
 
     return jsonify({"transcript": transcript})
+# ===== BACKGROUND WARM-UP =====
+# WARM_UP_CLIENTS=0 skips creating the Google clients (the command line tools don't use them)
+WARM_UP_CLIENTS = os.environ.get("WARM_UP_CLIENTS", "1").lower() not in ("0", "false", "no") and not BATCH_WORKER
+
+def warm_up():
+    """Load what the matchers need, then the Google clients, off the import path"""
+    start = time.time()
+    try:
+        load_matching()
+        print(f"Matching ready {time.time() - start:.2f}s after warm-up started")
+    finally:
+        boot_profiler.mark("corpus_ready")
+        CORPUS_READY.set()
+
+    # Only the serving process watches the corpus files (and rewrites the snapshot)
+    if CORPUS_RELOAD_INTERVAL > 0 and not BATCH_WORKER:
+        threading.Thread(target=watch_corpus, name="corpus-watcher", daemon=True).start()
+
+    if WARM_UP_CLIENTS:
+        for name, init in (("gemini", gemini_ready), ("tts_client", get_tts_client), ("speech_client", get_speech_client)):
+            try:
+                with boot_profiler.phase(name):
+                    init()
+            except Exception as e:
+                logger.warning(f"Could not initialize {name} at startup: {e}")
+        boot_profiler.mark("clients_ready")
+    boot_profiler.finish()
+
+boot_profiler.mark("module_loaded")
+threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
     # Production-ready configuration for presidential presentation
@@ -0,0 +1,196 @@
+"""Microbenchmarks for the matching and detection functions of app.py.
+
+    python benchmark.py              # run and compare with the saved baseline
+    python benchmark.py --save       # run and store the results as the new baseline
+    python benchmark.py --only match # run only the benchmarks whose name contains 'match'
+
+Every benchmark cycles through the same realistic Italian inputs and reports
+ops/sec and p50/p99 latency per call. Save a baseline before editing app.py:
+afterwards benchmarks whose p50 got slower than --tolerance allows are
+flagged and the exit status is 1. Spelling corrections are memoized, so
+by default the numbers are warm-cache ones; --cold clears the correction
+caches before every call.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+from cli_common import import_app
+
+app, report_out = import_app()
+app.wait_for_corpus(None)
+
+BASELINE_PATH = os.environ.get("BENCHMARK_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json"))
+
+# Typical voice-assistant messages, typos and all, plus a few non-Italian ones
+MESSAGES = [
+    "quali sono gli orari di apertura della farmacia",
+    "come posso prenotare un test dell'udito gratuito",
+    "quanto costa un apparecchio acustico",
+    "ho un fischio nelle orecchie da qualche giorno cosa devo fare",
+    "dove si trova la sede di otofarma",
+    "gli apparechi acustici sono rimborsabili dalla asl",
+    "come si pulisce l'aparecchio acustico",
+    "la batteria del mio apparecchio dura poco",
+    "sento male quando sono in un ristorante rumoroso",
+    "che cos'è l'acufene",
+    "vorrei parlare con un audioprotesista",
+    "what are your opening hours",
+]
+
+PHARMACY_MESSAGES = [
+    "ci sono farmacie otofarma a milano",
+    "farmacia otofarma a napoli in via salvator rosa",
+    "numero di telefono della farmacia di torino",
+    "quali farmacie avete in provincia di bari",
+    "farmacia vicino a me",
+    "indirizzo della farmacia a palermo",
+    "mi serve una farmacia aperta a roma",
+    "c'è una farmacia a torre santa susanna",
+]
+
+# (lat, lon) of Milano, Roma, Napoli, Bari, Torino, Palermo, Cagliari and a rural point
+COORDINATES = [
+    (45.4642, 9.1900), (41.9028, 12.4964), (40.8518, 14.2681), (41.1171, 16.8719),
+    (45.0703, 7.6869), (38.1157, 13.3615), (39.2238, 9.1217), (42.3498, 13.3995),
+]
+
+
+def analysis_args(msg):
+    """Matcher arguments with the message already spelling-corrected and normalized"""
+    analysis = app.MessageAnalysis(msg)
+    analysis.normalized
+    return analysis, app.corpus_index.questions, app.corpus_index.answers
+
+
+def benchmarks():
+    """(name, function, inputs, prepare) for every benchmark; prepare builds the call arguments untimed"""
+    corpus = app.corpus_index
+    single = lambda value: (value,)
+
+    return [
+        ("normalize", app.normalize, MESSAGES, single),
+        ("correct_spelling", app.correct_spelling, MESSAGES, single),
+        ("extract_keywords", app.extract_keywords, MESSAGES, single),
+        ("intelligent_exact_match",
+         lambda *args: app.intelligent_exact_match(*args, index=corpus.exact), MESSAGES, analysis_args),
+        ("enhanced_keyword_match",
+         lambda *args: app.enhanced_keyword_match(*args, index=corpus.keywords), MESSAGES, analysis_args),
+        ("semantic_match",
+         lambda *args: app.semantic_match(*args, index=corpus.semantic, candidates=corpus.bm25.top_k(args[0].normalized)),
+         MESSAGES, analysis_args),
+        ("fuzzy_match",
+         lambda *args: app.fuzzy_match(*args, candidates=corpus.bm25.top_k(args[0].normalized), questions_norm=corpus.questions_norm),
+         MESSAGES, analysis_args),
+        ("match_yaml_qa_scored", app.match_yaml_qa_scored, MESSAGES, single),
+        ("is_probably_italian", app.is_probably_italian, MESSAGES + PHARMACY_MESSAGES, single),
+        ("is_pharmacy_question", app.is_pharmacy_question, MESSAGES + PHARMACY_MESSAGES, single),
+        ("extract_city_from_query", app.extract_city_from_query, PHARMACY_MESSAGES, single),
+        ("pharmacy_best_match", app.pharmacy_best_match, PHARMACY_MESSAGES, single),
+        ("nearest_pharmacy", app.nearest_pharmacy, COORDINATES, lambda point: point),
+    ]
+
+
+def run_benchmark(func, inputs, prepare, seconds, min_rounds, cold):
+    """Time single calls over the inputs for at least `seconds` and min_rounds passes; returns call times in ns"""
+    for value in inputs:
+        func(*prepare(value))
+
+    timings = []
+    clock = time.perf_counter_ns
+    deadline = time.perf_counter() + seconds
+    rounds = 0
+    while rounds < min_rounds or time.perf_counter() < deadline:
+        for value in inputs:
+            args = prepare(value)
+            if cold:
+                app.invalidate_spelling_caches()
+            start = clock()
+            func(*args)
+            timings.append(clock() - start)
+        rounds += 1
+    return np.array(timings, dtype=np.int64)
+
+
+def summarize(timings):
+    return {
+        "calls": int(len(timings)),
+        "ops_per_sec": round(1e9 * len(timings) / max(int(timings.sum()), 1), 1),
+        "p50_us": round(float(np.percentile(timings, 50)) / 1000, 2),
+        "p99_us": round(float(np.percentile(timings, 99)) / 1000, 2),
+    }
+
+
+def load_baseline(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the Otofarma matching and detection functions")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this text")
+    parser.add_argument("--seconds", type=float, default=1.0, help="minimum time per benchmark (default: %(default)s)")
+    parser.add_argument("--rounds", type=int, default=5, help="minimum passes over the inputs (default: %(default)s)")
+    parser.add_argument("--cold", action="store_true", help="clear the spelling caches before every call")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file (default: %(default)s)")
+    parser.add_argument("--save", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="flag benchmarks whose p50 is this much slower than the baseline (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    baseline = None if args.save else load_baseline(args.baseline)
+    if baseline and baseline.get("cold") != args.cold:
+        print(f"Baseline was recorded with{'out' if args.cold else ''} --cold: not comparing", file=sys.stderr)
+        baseline = None
+    previous = baseline["results"] if baseline else {}
+
+    results = {}
+    regressions = []
+    report_out.write(f"{'benchmark':<26}{'ops/sec':>12}{'p50 us':>10}{'p99 us':>10}{'vs base':>10}\n")
+    for name, func, inputs, prepare in benchmarks():
+        if args.only and args.only not in name:
+            continue
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            timings = run_benchmark(func, inputs, prepare, args.seconds, args.rounds, args.cold)
+        stats = results[name] = summarize(timings)
+
+        change = ""
+        if name in previous and previous[name]["p50_us"] > 0:
+            ratio = stats["p50_us"] / previous[name]["p50_us"]
+            change = f"{ratio:.2f}x"
+            if ratio > 1 + args.tolerance:
+                change += " !"
+                regressions.append(name)
+        report_out.write(f"{name:<26}{stats['ops_per_sec']:>12,.0f}{stats['p50_us']:>10.2f}{stats['p99_us']:>10.2f}{change:>10}\n")
+        report_out.flush()
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cold": args.cold,
+                "corpus_questions": len(app.corpus_index.questions),
+                "pharmacies": len(app.pharmacies),
+                "results": results,
+            }, f, indent=2)
+        report_out.write(f"Baseline saved to {args.baseline}\n")
+    elif baseline is None:
+        report_out.write(f"No baseline at {args.baseline}: run with --save to record one\n")
+    elif regressions:
+        report_out.write(f"Slower than the baseline: {', '.join(regressions)}\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+"""Compile the YAML corpus and the spelling index into the startup snapshot.
+
+Run it as a deploy build step so that workers memory-map the compiled
+corpus at boot instead of parsing YAML and fitting the indexes:
+
+    python build_corpus.py
+"""
+import os
+
+from cli_common import configure_offline
+
+os.environ["CORPUS_SNAPSHOT_REBUILD"] = "1"
+configure_offline()
+
+import app  # noqa: E402  (app compiles the corpus and writes the snapshot while warming up)
+
+if __name__ == "__main__":
+    app.wait_for_corpus(None)
+    if not os.path.isfile(app.CORPUS_SNAPSHOT_PATH):
+        raise SystemExit(f"Corpus snapshot was not written to {app.CORPUS_SNAPSHOT_PATH}")
+    print(f"{len(app.qa_questions)} Q&A pairs compiled into {app.CORPUS_SNAPSHOT_PATH}")
@@ -0,0 +1,19 @@
+"""Start-up shared by the command line tools that import app.py."""
+import os
+import sys
+
+
+def configure_offline():
+    """Environment for a tool run: no corpus hot reload, no Google clients, no boot report"""
+    os.environ.setdefault("CORPUS_RELOAD_INTERVAL", "0")
+    os.environ.setdefault("WARM_UP_CLIENTS", "0")
+    os.environ.setdefault("BOOT_REPORT_PATH", "")
+
+
+def import_app():
+    """Import app offline with its diagnostics (printed on stdout) sent to stderr: (app, the real stdout)"""
+    configure_offline()
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    import app
+    return app, out
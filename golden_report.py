@@ -0,0 +1,235 @@
+"""Replay the golden queries through the chat endpoint and report quality and latency.
+
+    python golden_report.py          # report and diff against the saved baseline
+    python golden_report.py --save   # report and store the results as the new baseline
+
+Every entry of golden_queries.yaml is posted to /chat through the Flask
+test client, with Gemini, text-to-speech and the appointment e-mails and
+database stubbed out. The report gives accuracy per expected route and
+per category with the latency distribution, and lists the queries whose
+outcome changed since the baseline. The exit status is 1 when a query that
+was answered correctly in the baseline no longer is.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+
+import flask
+import numpy as np
+import yaml
+
+from cli_common import import_app
+
+app, report_out = import_app()
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(HERE, "golden_queries.yaml")
+BASELINE_PATH = os.environ.get("GOLDEN_BASELINE", os.path.join(HERE, "golden_baseline.json"))
+
+
+def load_golden(path):
+    with open(path, encoding="utf-8") as f:
+        items = yaml.safe_load(f) or []
+    for item in items:
+        if not item.get("message") or not item.get("route"):
+            raise SystemExit(f"Golden entry without message or route: {item}")
+    return items
+
+
+def expected_answers(item, corpus):
+    """Acceptable replies of a yaml entry: every answer of its expected questions (None if it has none)"""
+    questions = item.get("question")
+    if not questions:
+        return None
+    if isinstance(questions, str):
+        questions = [questions]
+    wanted = set(questions)
+    return {a for q, a in zip(corpus.questions, corpus.answers) if q in wanted}
+
+
+def check(item, record, corpus):
+    """(correct, reason) of one replayed golden entry"""
+    if record["route"] != item["route"]:
+        return False, f"route {record['route']}"
+    answers = expected_answers(item, corpus)
+    if answers is not None:
+        if not answers:
+            return False, "expected question not in corpus"
+        if record["reply"] not in answers:
+            return False, "other answer"
+    contains = item.get("contains")
+    if contains and contains.lower() not in (record["reply"] or "").lower():
+        return False, f"reply lacks '{contains}'"
+    return True, ""
+
+
+def stub_side_effects():
+    """Keep the replay offline and free of side effects: no Gemini, speech, e-mail or database writes"""
+    app.gemini_ready = lambda: False
+    app.get_gemini_conversation = lambda *args, **kwargs: None
+    app.cache_tts_background = lambda text: None
+    app.send_appointment_email = lambda *args: None
+    app.save_appointment_to_db = lambda *args: None
+
+
+def post_chat(client, message):
+    """Route, strategy, reply and latency of one message posted to /chat"""
+    start = time.perf_counter()
+    response = client.post("/chat", json={"message": message})
+    latency_ms = round((time.perf_counter() - start) * 1000, 3)
+    route, strategy, _ = flask.g.route
+    return {"route": route, "strategy": strategy, "reply": response.get_json()["reply"], "latency_ms": latency_ms}
+
+
+def replay(items):
+    """Records of every golden entry with its outcome, after a warm-up pass and with cold spelling caches"""
+    stub_side_effects()
+    app.wait_for_corpus(None)
+    client = app.app.test_client()
+    # The client keeps the last request's context open, so chat()'s g.route can be read back
+    with client:
+        for item in items:
+            post_chat(client, item["message"])
+        app.invalidate_spelling_caches()
+        records = [post_chat(client, item["message"]) for item in items]
+
+    corpus = app.corpus_index
+    results = []
+    for item, record in zip(items, records):
+        correct, reason = check(item, record, corpus)
+        results.append({
+            "message": item["message"],
+            "category": item.get("category", "other"),
+            "expected": item["route"],
+            "route": record["route"],
+            "strategy": record["strategy"],
+            "reply": hashlib.sha1((record["reply"] or "").encode("utf-8")).hexdigest()[:12],
+            "correct": correct,
+            "reason": reason,
+            "latency_ms": record["latency_ms"],
+        })
+    return results
+
+
+def summarize(results, key):
+    groups = defaultdict(list)
+    for r in results:
+        groups[r[key]].append(r)
+    summary = {}
+    for name, rows in sorted(groups.items()):
+        latencies = np.array([r["latency_ms"] for r in rows])
+        summary[name] = {
+            "total": len(rows),
+            "correct": sum(r["correct"] for r in rows),
+            "accuracy": round(sum(r["correct"] for r in rows) / len(rows), 3),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p99_ms": round(float(np.percentile(latencies, 99)), 2),
+        }
+    return summary
+
+
+def latency_distribution(results):
+    latencies = np.array([r["latency_ms"] for r in results])
+    return {
+        f"p{q}_ms": round(float(np.percentile(latencies, q)), 2) for q in (50, 90, 99)
+    } | {"max_ms": round(float(latencies.max()), 2), "mean_ms": round(float(latencies.mean()), 2)}
+
+
+def write_table(title, summary, previous):
+    report_out.write(f"\n{title:<20}{'total':>7}{'correct':>9}{'accuracy':>10}{'base':>8}{'p50 ms':>9}{'p99 ms':>9}\n")
+    for name, s in summary.items():
+        base = previous.get(name)
+        base_acc = f"{base['accuracy']:.0%}" if base else "-"
+        report_out.write(f"{name:<20}{s['total']:>7}{s['correct']:>9}{s['accuracy']:>10.0%}{base_acc:>8}{s['p50_ms']:>9.2f}{s['p99_ms']:>9.2f}\n")
+
+
+def diff(results, baseline):
+    """(fixed, broken, changed) queries compared with the baseline results"""
+    before = {r["message"]: r for r in baseline["results"]}
+    fixed, broken, changed = [], [], []
+    for r in results:
+        old = before.get(r["message"])
+        if old is None:
+            continue
+        if r["correct"] and not old["correct"]:
+            fixed.append((r, old))
+        elif old["correct"] and not r["correct"]:
+            broken.append((r, old))
+        elif r["route"] != old["route"] or (r["route"] == "yaml" and r["reply"] != old["reply"]):
+            # other routes pick their replies at random, so only yaml replies are compared
+            changed.append((r, old))
+    return fixed, broken, changed
+
+
+def outcome(r):
+    return r["route"] + (f"/{r['strategy']}" if r["strategy"] else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Golden-query quality and latency report for the Otofarma chat endpoint")
+    parser.add_argument("--golden", default=GOLDEN_PATH, help="golden queries (default: %(default)s)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file (default: %(default)s)")
+    parser.add_argument("--save", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--failures", action="store_true", help="list every query answered incorrectly")
+    args = parser.parse_args(argv)
+
+    results = replay(load_golden(args.golden))
+    by_route = summarize(results, "expected")
+    by_category = summarize(results, "category")
+    latency = latency_distribution(results)
+    correct = sum(r["correct"] for r in results)
+
+    baseline = None
+    if not args.save and os.path.isfile(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    write_table("expected route", by_route, baseline["by_route"] if baseline else {})
+    write_table("category", by_category, baseline["by_category"] if baseline else {})
+    report_out.write(f"\nOverall: {correct}/{len(results)} correct ({correct / len(results):.1%})")
+    if baseline:
+        report_out.write(f", baseline {baseline['correct']}/{len(baseline['results'])}")
+    report_out.write("\nLatency: " + "  ".join(
+        f"{name[:-3]} {value:.2f} ms" + (f" ({value / baseline['latency'][name]:.2f}x)" if baseline and baseline["latency"].get(name) else "")
+        for name, value in latency.items()
+    ) + "\n")
+
+    if args.failures:
+        report_out.write("\nIncorrect:\n")
+        for r in results:
+            if not r["correct"]:
+                report_out.write(f"  [{r['expected']}] {r['message']}: {r['reason']}\n")
+
+    status = 0
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "correct": correct,
+                "by_route": by_route,
+                "by_category": by_category,
+                "latency": latency,
+                "results": results,
+            }, f, indent=2, ensure_ascii=False)
+        report_out.write(f"\nBaseline saved to {args.baseline}\n")
+    elif baseline is None:
+        report_out.write(f"\nNo baseline at {args.baseline}: run with --save to record one\n")
+    else:
+        fixed, broken, changed = diff(results, baseline)
+        for title, rows in (("Now correct", fixed), ("No longer correct", broken), ("Answered differently", changed)):
+            if rows:
+                report_out.write(f"\n{title}:\n")
+                for r, old in rows:
+                    report_out.write(f"  {r['message']}: {outcome(old)} -> {outcome(r)}\n")
+        if not (fixed or broken or changed):
+            report_out.write("\nNo answer changed since the baseline\n")
+        status = 1 if broken else 0
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
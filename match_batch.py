@@ -0,0 +1,38 @@
+"""Route a file of messages through the chat matching and print NDJSON results.
+
+    python match_batch.py questions.txt --workers 4 > results.ndjson
+
+The input is a JSON array or a text file with one message per line ('-'
+reads stdin). Each output line has the route, YAML strategy, score, reply
+and latency of one message, in input order.
+"""
+import argparse
+import json
+import sys
+
+from cli_common import import_app
+
+app, results_out = import_app()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-route messages through the Otofarma chat matching")
+    parser.add_argument("input", help="JSON array or text file with one message per line ('-' for stdin)")
+    parser.add_argument("--workers", type=int, default=app.MATCH_BATCH_WORKERS,
+                        help="worker processes (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.input == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            text = f.read()
+
+    app.MATCH_BATCH_WORKERS = args.workers
+    for record in app.match_batch(app.parse_batch_messages(text), workers=args.workers):
+        results_out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        results_out.flush()
+
+
+if __name__ == "__main__":
+    main()